@@ -1,33 +1,41 @@
+import datetime as d
 import os
+import pathlib as p
 import random
+import secrets
 import textwrap
 import typing as t
 
 import streamlit as st
 
-from lib.local import Session, Video
+from lib.catalog import Catalog, Entry, Shuffle, browse, version
+from lib.config import MEDIA_HOST, MEDIA_PORT, MEDIA_SECRET, MEDIA_URL
+from lib.search import Hit, search
+from lib.serve import Server, url
+from lib.thumbnail import thumbnail
 
 
 class Choice:
-    def __init__(self, sequence: t.List[str]) -> None:
-        self._sequence = sequence
-        self._length = len(sequence)
-
-    @property
-    def sequence(self) -> t.List[str]:
-        return self._sequence
+    # a shuffled walk through the catalog, kept per session as a seed and a step instead of a list of keys
+    def __init__(self, catalog: Catalog) -> None:
+        self._catalog = catalog
+        self._length = max(1, len(catalog))
+        if 'seed' not in st.session_state:
+            self.seed = random.getrandbits(64)
+            self.index = 0
+        self._shuffle = Shuffle(self.seed, self._length)
 
     @property
-    def playlist(self) -> t.List[str]:
-        return st.session_state['playlist']
+    def seed(self) -> int:
+        return st.session_state['seed']
 
-    @playlist.setter
-    def playlist(self, value: t.List[str]):
-        st.session_state['playlist'] = value
+    @seed.setter
+    def seed(self, value: int) -> None:
+        st.session_state['seed'] = value
 
     @property
     def index(self) -> int:
-        return st.session_state['index']
+        return st.session_state['index'] % self._length
 
     @index.setter
     def index(self, value: int) -> None:
@@ -39,51 +47,155 @@ class Choice:
     def prev(self) -> None:
         self.index = (self.index - 1) % self._length
 
-    def current(self) -> int:
-        if 'playlist' not in st.session_state:
-            sequence = self._sequence.copy()
-            random.shuffle(sequence)
-            self.playlist = sequence
-            self.index = 0
-        return self.index
+    def current(self) -> Entry:
+        return self._catalog.entry(self._shuffle[self.index])
+
+    def select(self, id: int) -> None:
+        self.index = self._shuffle.index(self._catalog.position(id))
+
+
+class Pages:
+    # keyset pages: only the ids each visited page starts before are kept, and reset once the filter changes
+    def __init__(self, filter: t.Tuple[t.Any, ...]) -> None:
+        if st.session_state.get('filter') != filter:
+            st.session_state['filter'] = filter
+            st.session_state['cursors'] = [None]
+
+    @property
+    def cursors(self) -> t.List[t.Optional[int]]:
+        return st.session_state['cursors']
+
+    @property
+    def number(self) -> int:
+        return len(self.cursors)
+
+    def next(self, last: int) -> None:
+        self.cursors.append(last)
+
+    def prev(self) -> None:
+        if len(self.cursors) > 1:
+            self.cursors.pop()
+
+
+@st.cache_resource(max_entries=4)
+def load(public: bool, version: t.Tuple[int, ...]) -> Catalog:
+    return Catalog(public)
+
+
+@st.cache_resource
+def media() -> t.Tuple[str, bytes]:
+    # parts are streamed with Range requests by a local server instead of going through st.video;
+    # files of videos that are not public take urls signed with a secret only this process (or MEDIA_SECRET) knows
+    secret = MEDIA_SECRET or secrets.token_bytes(32)
+    try:
+        Server(MEDIA_HOST, MEDIA_PORT, secret).start()
+    except OSError:  # already served, e.g. by `python -m lib serve` (sharing MEDIA_SECRET) or another app process
+        pass
+    return MEDIA_URL, secret
+
+
+def image(path: p.Path, size: int) -> str:
+    # a cached WebP/JPEG derivative when Pillow is around, else the original cover
+    derivative = thumbnail(path, size)
+    return url(base, 'cover', path, signing) if derivative is None else url(base, 'thumbnail', derivative, signing)
+
+
+def pick(id: int) -> None:
+    choice.select(id)
+    st.session_state['view'] = 'Player'
+
+
+def picked(key: str) -> None:
+    # on change only: a radio keeps its value over reruns, and would undo Prev/Next otherwise
+    if st.session_state[key] is not None:
+        choice.select(st.session_state[key].id)
+
+
+@st.cache_data(max_entries=64)
+def find(query: str, public: bool, page: int, version: t.Tuple[int, ...]) -> t.Tuple[int, t.List[Hit]]:
+    return search(query, public, limit=20, offset=(page-1)*20)
+
+
+@st.cache_data(max_entries=256)
+def page(
+    public: bool, size: int, before: t.Optional[int], author: str, tag: str,
+    since: t.Optional[int], until: t.Optional[int], version: t.Tuple[int, ...],
+) -> t.List[Entry]:
+    return browse(public, size, before, author, tag, since, until)
+
+
+def timestamps(dates: t.Sequence[d.date]) -> t.Tuple[t.Optional[int], t.Optional[int]]:
+    ans = [int(d.datetime.combine(date, d.time()).timestamp()) for date in dates]
+    since = ans[0] if ans else None
+    until = ans[1] + 86400 if len(ans) > 1 else None  # the end date is inclusive
+    return since, until
 
 
 # page config
 st.set_page_config(page_title='bilibili-backup-app', page_icon='random', layout='wide')
 # sidebar
-with Session() as session:
-    is_login = os.environ.get('ADMIN', 'admin') not in \
-        st.experimental_get_query_params().get('user', [])
-    videos = {
-        f'{video.id} {video.title}': video
-        for video in session
-            .query(Video)
-            .filter_by(public=is_login)
-            .order_by(Video.id.desc())
-    }
-    choice = Choice(list(videos.keys()))
+is_login = os.environ.get('ADMIN', 'admin') not in \
+    st.experimental_get_query_params().get('user', [])
+catalog = load(is_login, version())
+if not len(catalog):
+    st.info('Nothing synced yet.')
+    st.stop()
+choice = Choice(catalog)
+base, secret = media()
+signing = None if is_login else secret  # only the admin view gets signed urls
 with st.sidebar:
-    threshold = st.slider('Auto-display Threshold (MB)', min_value=1, max_value=128, value=32)
     st.form('prev').form_submit_button('Prev', on_click=choice.prev, use_container_width=True)
     st.form('next').form_submit_button('Next', on_click=choice.next, use_container_width=True)
-    key = st.selectbox('Video', index=choice.current(), options=choice.playlist)
-    choice.index = choice.playlist.index(key)
-    video = videos[key]
-    st.image(video.cover.as_posix(), caption=f'ID: {video.id}', use_column_width=True)
+    view = st.radio('View', ['Player', 'Gallery'], key='view', horizontal=True)
+    query = st.text_input('Search')
+    if query:
+        number = st.number_input('Result Page', min_value=1, value=1)
+        total, hits = find(query, is_login, number, version())
+        st.radio(
+            f'{total} Result(s)', hits, index=None, key='hit', on_change=picked, args=('hit',),
+            format_func=lambda hit: f'{hit.id} {hit.title}',
+        )
+    with st.expander('Browse', expanded=view == 'Gallery'):
+        author = st.text_input('Author')
+        tag = st.text_input('Tag')
+        since, until = timestamps(st.date_input('Published', value=(), format='YYYY-MM-DD'))
+        size = 48 if view == 'Gallery' else 20
+        pages = Pages((is_login, size, author, tag, since, until))
+        entries = page(is_login, size, pages.cursors[-1], author, tag, since, until, version())
+        left, right = st.columns(2)
+        left.button('Newer', on_click=pages.prev, disabled=pages.number == 1, use_container_width=True)
+        right.button(
+            'Older', on_click=pages.next, args=(entries[-1].id if entries else 0,),
+            disabled=len(entries) < size, use_container_width=True,
+        )
+        if view == 'Player':
+            st.radio(
+                f'Page {pages.number}', entries, index=None, key='entry', on_change=picked, args=('entry',),
+                format_func=lambda entry: f'{entry.id} {entry.title}',
+            )
+    video = choice.current()
+    st.markdown(f'<img src="{image(video.cover, 640)}" style="width:100%">', unsafe_allow_html=True)
+    st.caption(f'ID: {video.id}')
     st.markdown('## [{title}]({url})\n\n### {tags}\n\n{body}'.format(
         title=video.title,
-        url=video.to_remote().url,
+        url=video.url,
         tags=' '.join(map('`{}`'.format, filter(bool, video.tags.split('\t')))),
         body=textwrap.indent(video.description, '> '),
     ))
 # main
-paths: t.Dict[str, t.Tuple[str, bool]] = {
-    path.stem: (
-        path.as_posix(),
-        path.stat().st_size > threshold * 1048576,
-    ) for path in video.directory.glob('*.mp4')
-}
-index = None if any(value[1] for value in paths.values()) else 0
-key = st.selectbox(f'Total {len(paths)} Part(s)', sorted(paths.keys()), index=index)
-if key is not None:
-    st.video(paths[key][0])
+if view == 'Gallery':
+    width = 6
+    for row in range(0, len(entries), width):
+        for column, entry in zip(st.columns(width), entries[row:row+width]):
+            with column:
+                st.markdown(f'<img src="{image(entry.cover, 320)}" loading="lazy" style="width:100%">', unsafe_allow_html=True)
+                st.button(entry.title, key=f'pick {entry.id}', on_click=pick, args=(entry.id,), use_container_width=True)
+else:
+    parts = {part.stem: part for part in catalog.parts(video.id)}
+    key = st.selectbox(
+        f'Total {len(parts)} Part(s)', sorted(parts.keys()), index=0,
+        format_func=lambda key: f'{key} ({parts[key].size/1048576:.0f} MB)',
+    )
+    if key is not None:
+        src = url(base, 'video', p.Path(parts[key].path), signing)
+        st.markdown(f'<video controls preload="metadata" src="{src}" style="width:100%"></video>', unsafe_allow_html=True)
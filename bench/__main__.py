@@ -0,0 +1,375 @@
+import concurrent.futures as cf
+import contextlib
+import json
+import os
+import pathlib as p
+import subprocess as sp
+import sys
+import tempfile
+import time
+import typing as t
+
+import click
+
+
+_results: t.Dict[str, t.Dict[str, float]] = {}
+
+
+@click.group()
+@click.option('--output', '-o', type=click.Path(dir_okay=False, resolve_path=True), default=None,
+              help='Merge results into this JSON file, e.g. one per commit for `compare`.')
+@click.pass_context
+def cli(ctx: click.Context, output: t.Optional[str]) -> None:
+    if output is not None:
+        ctx.call_on_close(lambda: _save(p.Path(output)))
+
+
+@cli.command()
+@click.option('--requests', '-n', default=500)
+@click.option('--threads', '-t', default=8)
+@click.option('--latency', '-l', default=0.0, help='Stub server latency (s).')
+def client(requests: int, threads: int, latency: float) -> None:
+    with _sandbox():
+        import httpx
+
+        from lib.config import HEADERS
+        from lib.util import get
+
+        from .server import Server
+
+        def before(url: str) -> httpx.Response:
+            return httpx.get(url, headers=HEADERS)
+
+        with Server(latency) as server:
+            url = f'{server.url}/x/web-interface/wbi/view/detail'
+            for name, function in [('before', before), ('after', get)]:
+                for workers in sorted({1, threads}):
+                    _record(f'client {name} {workers}', {'req/s': _rate(function, url, requests, workers)})
+
+
+@cli.command()
+@click.option('--size', '-s', default=64, help='Stream size (MiB).')
+@click.option('--connections', '-c', default=4)
+@click.option('--latency', '-l', default=0.0, help='Stub server latency (s).')
+def download(size: int, connections: int, latency: float) -> None:
+    with _sandbox() as directory:
+        from lib.download import Downloader
+
+        from .server import Server
+
+        content = os.urandom(size << 20)
+        with Server(latency, files={'/video.m4s': content}) as server:
+            downloader = Downloader(0, directory, connections)
+            stream = {'kind': 'video', 'file': 'video.m4s', 'url': f'{server.url}/video.m4s', 'size': len(content), 'done': []}
+            # first attempt: keep half of the chunks as if the run had been interrupted
+            downloader.fetch([stream])
+            stream['done'] = stream['done'][:len(stream['done'])//2]
+            start = time.perf_counter()
+            downloader.fetch([stream])
+            resumed = time.perf_counter() - start
+            assert (directory/'video.m4s').read_bytes() == content
+            stream['done'] = []
+            start = time.perf_counter()
+            downloader.fetch([stream])
+            elapsed = time.perf_counter() - start
+    _record('download', {'MiB/s': size/elapsed, 'seconds': elapsed, 'resume seconds': resumed})
+
+
+@cli.command()
+@click.option('--videos', '-n', default=2000)
+@click.option('--latency', '-l', default=0.05, help='Stand-in latency (s).')
+@click.option('--throttle', default=0.0, help='Share of API responses that are 412.')
+@click.option('--errors', default=0.0, help='Share of API responses that are 500.')
+@click.option('--rates', is_flag=True, default=False, help='Keep the real per-host rate limits.')
+def paging(videos: int, latency: float, throttle: float, errors: float, rates: bool) -> None:
+    with _sandbox(), _stand_in(rates, latency=latency, throttle=throttle, errors=errors, videos=videos):
+        from lib.remote import Favorite
+
+        start = time.perf_counter()
+        number = sum(1 for _ in Favorite(1).videos())
+        elapsed = time.perf_counter() - start
+        assert number == videos, number
+    _record('paging', {'videos/s': number/elapsed, 'seconds': elapsed, **_http()})
+
+
+@cli.command()
+@click.option('--videos', '-n', default=500)
+@click.option('--authors', '-a', default=50)
+@click.option('--latency', '-l', default=0.05, help='Stand-in latency (s).')
+@click.option('--throttle', default=0.0, help='Share of API responses that are 412.')
+@click.option('--errors', default=0.0, help='Share of API responses that are 500.')
+@click.option('--rates', is_flag=True, default=False, help='Keep the real per-host rate limits.')
+@click.option('--downloads', '-d', default=4)
+@click.option('--enrichers', '-e', default=4)
+@click.option('--batch', '-b', default=64)
+def sync(
+    videos: int, authors: int, latency: float, throttle: float, errors: float, rates: bool,
+    downloads: int, enrichers: int, batch: int,
+) -> None:
+    kwargs = {'latency': latency, 'throttle': throttle, 'errors': errors, 'videos': videos, 'authors': authors}
+    with _sandbox(), _stand_in(rates, **kwargs):
+        from lib.local import Session, Video
+        from lib.pipeline import Pipeline
+        from lib.remote import Favorite
+
+        # downloads count as done (a directory without a manifest); `bench download` covers them
+        for id in range(1, videos+1):
+            Video._directory(id).mkdir(parents=True, exist_ok=True)
+        with Session() as session:
+            pipeline = Pipeline(session, downloads, enrichers, batch=batch)
+            start = time.perf_counter()
+            number = pipeline.run(Favorite(1).videos())
+            elapsed = time.perf_counter() - start
+            assert session.query(Video).count() == number - len(pipeline.failed)
+    _record('sync', {'videos/s': number/elapsed, 'seconds': elapsed, 'failed': len(pipeline.failed), **_http()})
+
+
+@cli.command()
+@click.option('--rows', '-n', default=20000)
+@click.option('--batch', '-b', default=256)
+def writes(rows: int, batch: int) -> None:
+    with _sandbox():
+        from lib.local import Author, Session
+
+        def author(id: int, name: str = '') -> Author:
+            return Author(id=id, name=name or f'author {id}')
+
+        with Session() as session:
+            few = max(1, rows//20)  # one commit per row is slow enough with a twentieth of the rows
+            start = time.perf_counter()
+            for id in range(1, few+1):
+                session.add(author(id))
+            single = few / (time.perf_counter()-start)
+            start = time.perf_counter()
+            with session.batch(batch, float('inf')) as pending:
+                for id in range(few+1, few+rows+1):
+                    pending.put(author(id))
+            inserted = rows / (time.perf_counter()-start)
+            start = time.perf_counter()
+            with session.batch(batch, float('inf')) as pending:
+                for id in range(few+1, few+rows+1):
+                    pending.put(author(id, f'renamed {id}'))
+            updated = rows / (time.perf_counter()-start)
+    _record('writes', {'add rows/s': single, 'batch insert rows/s': inserted, 'batch upsert rows/s': updated})
+
+
+@cli.command()
+@click.option('--videos', '-n', default=50000)
+@click.option('--repeat', '-r', default=5)
+def catalog(videos: int, repeat: int) -> None:
+    with _sandbox():
+        from lib.catalog import Catalog, version
+        from lib.local import Session
+
+        with Session() as session:
+            session.upsert(*_videos(videos))
+        seconds = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            loaded = Catalog(True)
+            seconds.append(time.perf_counter()-start)
+        start = time.perf_counter()
+        for id in loaded.ids:
+            loaded.entry(loaded.position(id))
+        lookups = len(loaded) / (time.perf_counter()-start)
+        start = time.perf_counter()
+        for _ in range(1000):
+            version()
+        checks = 1000 / (time.perf_counter()-start)
+    _record('catalog', {'load seconds': min(seconds), 'entries/s': lookups, 'version checks/s': checks})
+
+
+@cli.command()
+@click.option('--videos', '-n', default=100000)
+@click.option('--repeat', '-r', default=5)
+def search(videos: int, repeat: int) -> None:
+    # one page of hits per query, best of a few runs; 1-2 character terms (common in CJK) are LIKE scans
+    queries = {'phrase': 'video 4242', 'mixed': 'video 42', 'short': '42', 'one character': '7', 'none': 'zz'}
+    with _sandbox():
+        from lib.local import Session
+        from lib.search import search
+
+        with Session() as session:
+            session.upsert(*_videos(videos))
+        values = {}
+        for name, query in queries.items():
+            seconds = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                search(query, True)
+                seconds.append(time.perf_counter()-start)
+            values[f'{name} ms'] = min(seconds) * 1000
+    _record('search', values)
+
+
+@cli.command()
+@click.option('--videos', '-n', default=500)
+@click.option('--comments', '-c', default=500, help='Danmaku per video.')
+@click.option('--workers', '-w', type=int, default=None)
+def danmaku(videos: int, comments: int, workers: t.Optional[int]) -> None:
+    from importlib.util import find_spec
+
+    if find_spec('jieba') is None:
+        raise click.ClickException('jieba is not installed')
+    with _sandbox():
+        from lib.danmaku import index, top
+        from lib.local import Session, Video
+
+        from .server import danmaku as xml
+
+        with Session() as session:
+            session.upsert(*_videos(videos))
+        for id in range(1, videos+1):
+            directory = Video._directory(id)
+            directory.mkdir(parents=True, exist_ok=True)
+            (directory/f'video {id}.cmt.xml').write_bytes(xml(id, comments))
+        start = time.perf_counter()
+        index(workers=workers)
+        full = time.perf_counter() - start
+        for id in range(1, videos+1, 10):
+            (Video._directory(id)/f'video {id}.cmt.xml').write_bytes(xml(-id, comments))
+        start = time.perf_counter()
+        index(workers=workers)
+        incremental = time.perf_counter() - start
+        start = time.perf_counter()
+        top(1024)
+        query = time.perf_counter() - start
+    _record('danmaku', {
+        'index videos/s': videos/full, 'reindex tenth seconds': incremental, 'top seconds': query,
+    })
+
+
+@cli.command()
+@click.option('--ids', '-n', default=200000)
+@click.option('--seed', '-s', default=0)
+def bvid(ids: int, seed: int) -> None:
+    # throughput only; correctness is tests/test_bvid.py
+    import random
+
+    from lib import bvid as codec
+
+    generator = random.Random(seed)
+    aids = [generator.randrange(1, codec.MAX_AID) for _ in range(ids)]
+    scalar = [codec._encode(aid) for aid in aids]
+    codec.avs(codec.bvs(aids[:codec.VECTOR]))  # numpy is imported on first use, not timed
+    values = {}
+    for name, function, data in [
+        ('scalar encode', lambda aids: list(map(codec._encode, aids)), aids),
+        ('scalar decode', lambda bvids: list(map(codec._decode, bvids)), scalar),
+        ('cached encode', lambda aids: list(map(codec.bv, aids)), aids[:1000]*(len(aids)//1000)),
+        ('batch encode', codec.bvs, aids),
+        ('batch decode', codec.avs, scalar),
+    ]:
+        start = time.perf_counter()
+        function(data)
+        values[f'{name} ids/s'] = len(data) / (time.perf_counter()-start)
+    _record(f'bvid numpy={codec.AVAILABLE}', values)
+
+
+@cli.command()
+@click.option('--repeat', '-r', default=5)
+def importtime(repeat: int) -> None:
+    # data only: the budget is enforced by tests/test_importtime.py
+    from .imports import COMMANDS, milliseconds
+
+    with _sandbox() as directory:
+        for args in COMMANDS:
+            _record(f'importtime {" ".join(["lib", *args])}', {'ms': milliseconds(args, directory, repeat)})
+
+
+@cli.command()
+@click.argument('base', type=click.Path(exists=True, dir_okay=False))
+@click.argument('head', type=click.Path(exists=True, dir_okay=False))
+def compare(base: str, head: str) -> None:
+    old, new = (json.loads(p.Path(path).read_text()) for path in (base, head))
+    click.echo(f'{old["commit"]} -> {new["commit"]}')
+    for name, values in new['results'].items():
+        for key, value in values.items():
+            before = old['results'].get(name, {}).get(key)
+            if before is None:
+                click.echo(f'{name:>16} {key:<24} {"-":>12} {value:>12.4g}')
+            else:
+                change = f'{(value/before-1)*100:+.1f}%' if before else '-'
+                click.echo(f'{name:>16} {key:<24} {before:>12.4g} {value:>12.4g} {change:>8}')
+
+
+def _record(name: str, values: t.Dict[str, float]) -> None:
+    _results[name] = values
+    click.echo(f'{name}: ' + ', '.join(f'{key} {value:.4g}' for key, value in values.items()))
+
+
+def _save(path: p.Path) -> None:
+    data = json.loads(path.read_text()) if path.exists() else {'results': {}}
+    data['results'].update(_results)
+    data['commit'] = sp.run(
+        ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+        cwd=p.Path(__file__).parents[1],
+    ).stdout.strip()
+    data['python'] = sys.version.split()[0]
+    data['time'] = int(time.time())
+    path.write_text(json.dumps(data, indent=2))
+
+
+@contextlib.contextmanager
+def _sandbox() -> t.Iterator[p.Path]:
+    # lib keeps everything under a relative data/, so a fresh working directory isolates a run;
+    # lib.local must not be used before this, as its engine binds to data/db.sqlite on first use
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            yield p.Path(directory)
+        finally:
+            os.chdir(cwd)
+
+
+@contextlib.contextmanager
+def _stand_in(rates: bool, **kwargs: t.Any) -> t.Iterator[t.Any]:
+    from lib.util import limit, route
+
+    from .server import ARedirect, Bilibili, Redirect, Server
+
+    with Server(handler=Bilibili, **kwargs) as server:
+        route(Redirect(server.url), ARedirect(server.url))
+        if not rates:
+            for host in ['api.bilibili.com', 'i0.hdslb.com', 'i1.hdslb.com']:
+                limit(host, 1e9, 1 << 30)
+        try:
+            yield server
+        finally:
+            route()
+
+
+def _http() -> t.Dict[str, float]:
+    from lib.metrics import report
+
+    data = report()
+    statuses = data['histograms'].get('http status', {})
+    return {
+        'requests': sum(statuses.values()),
+        'retries': data['counters'].get('retry', 0),
+        'throttled': statuses.get('412', 0) + statuses.get('429', 0),
+    }
+
+
+def _videos(number: int) -> t.List[t.Any]:
+    from lib.local import Author, Video
+
+    authors = [Author(id=id, name=f'author {id}') for id in range(1, number//10+2)]
+    return authors + [
+        Video(
+            id=id, title=f'video {id}', timestamp=1_600_000_000+id*3600, author_id=id//10+1,
+            tags=f'tag {id%3}\ttag {id%7}', description=f'description of video {id}', public=True,
+        ) for id in range(1, number+1)
+    ]
+
+
+def _rate(function: t.Callable[[str], t.Any], url: str, requests: int, workers: int) -> float:
+    start = time.perf_counter()
+    with cf.ThreadPoolExecutor(workers) as executor:
+        for response in executor.map(function, [url]*requests):
+            response.raise_for_status()
+    return requests / (time.perf_counter()-start)
+
+
+cli.main()
@@ -0,0 +1,31 @@
+import os
+import pathlib as p
+import re
+import subprocess as sp
+import sys
+import typing as t
+
+
+COMMANDS = [['--help'], ['login', '--help'], ['clean']]
+BUDGET = 50.0  # import milliseconds allowed per command, checked by tests/test_importtime.py
+
+
+def milliseconds(args: t.List[str], directory: p.Path, repeat: int = 5) -> float:
+    # everything imported from `lib` on, as reported by -X importtime; best of a few runs
+    env = {**os.environ, 'PYTHONPATH': p.Path(__file__).parents[1].as_posix()}
+    return min(
+        _imports(sp.run(
+            [sys.executable, '-X', 'importtime', '-m', 'lib', *args],
+            capture_output=True, text=True, cwd=directory, env=env, check=True,
+        ).stderr) for _ in range(repeat)
+    )
+
+
+def _imports(stderr: str) -> float:
+    ans, started = 0, False
+    for line in stderr.splitlines():
+        match = re.fullmatch(r'import time:\s+\d+ \|\s+(\d+) \| (\S.*)', line)  # top-level imports only
+        if match is not None:
+            started |= match[2] == 'lib'
+            ans += int(match[1]) if started else 0
+    return ans / 1000
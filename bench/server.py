@@ -0,0 +1,213 @@
+import hashlib
+import http.server as hs
+import json
+import random
+import re
+import threading as th
+import time
+import typing as t
+import urllib.parse as up
+
+import httpx
+import typing_extensions as te
+
+
+class Handler(hs.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    server: 'Server'
+
+    def do_GET(self) -> None:
+        time.sleep(self.server.latency)
+        path = self.path.partition('?')[0]
+        if path in self.server.files:
+            self.file(self.server.files[path])
+        else:
+            self.json({'code': 0, 'message': '0', 'data': {}})
+
+    def json(self, data: t.Any, status: int = 200) -> None:
+        self.body(json.dumps(data).encode(), 'application/json', status)
+
+    def body(self, body: bytes, type: str, status: int = 200, headers: t.Dict[str, str] = {}) -> None:
+        self.send_response(status)
+        self.send_header('Content-Type', type)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def file(self, content: bytes) -> None:
+        match = re.fullmatch(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if match is None:
+            return self.body(content, 'application/octet-stream', headers={'Accept-Ranges': 'bytes'})
+        start = int(match[1])
+        end = min(int(match[2] or len(content)-1), len(content)-1)
+        if start > end:
+            return self.body(b'', 'application/octet-stream', 416, {'Content-Range': f'bytes */{len(content)}'})
+        self.body(content[start:end+1], 'application/octet-stream', 206, {
+            'Accept-Ranges': 'bytes',
+            'Content-Range': f'bytes {start}-{end}/{len(content)}',
+        })
+
+    def log_message(self, *args: t.Any) -> None:
+        pass
+
+
+class Bilibili(Handler):
+    # deterministic stand-in for the endpoints lib talks to, routed on the path alone
+    def do_GET(self) -> None:
+        time.sleep(self.server.latency)
+        path, _, query = self.path.partition('?')
+        params = {key: int(value) for key, value in up.parse_qsl(query) if value.isdigit()}
+        if path.startswith('/x/'):
+            roll = random.random()
+            if roll < self.server.throttle:
+                return self.body(b'', 'text/plain', 412, {'Retry-After': '0'})
+            if roll < self.server.throttle + self.server.errors:
+                return self.body(b'', 'text/plain', 500)
+        route = self.ROUTES.get(path)
+        if route is not None:
+            self.json({'code': 0, 'message': '0', 'data': route(self, params)})
+        elif path.startswith('/bfs/'):
+            self.image(path)
+        elif path.startswith('/upgcxcode/'):
+            self.file(media(path, self.server.media))
+        elif path == '/x/v1/dm/list.so':
+            self.body(danmaku(params['oid']), 'text/xml')
+        elif path in self.server.files:
+            self.file(self.server.files[path])
+        else:
+            self.json({'code': -404, 'message': 'not found', 'data': None}, 404)
+
+    def favorite(self, params: t.Dict[str, int]) -> t.Dict[str, t.Any]:
+        number = self.server.videos
+        start = (params['pn']-1) * params['ps']
+        ids = range(number-start, max(0, number-start-params['ps']), -1)  # newest first, like order=mtime
+        return {'info': {'media_count': number}, 'medias': [self.media(id) for id in ids]}
+
+    def media(self, id: int) -> t.Dict[str, t.Any]:
+        mid = id%self.server.authors + 1
+        return {
+            'id': id, 'title': f'video {id}', 'pubtime': 1_600_000_000 + id*3600, 'attr': 9 if id%97 == 0 else 0,
+            'cover': f'https://i0.hdslb.com/bfs/archive/{id}.jpg',
+            'upper': {'mid': mid, 'name': f'author {mid}', 'face': f'https://i1.hdslb.com/bfs/face/{mid}.jpg'},
+        }
+
+    def detail(self, params: t.Dict[str, int]) -> t.Dict[str, t.Any]:
+        id = params['aid']
+        return {
+            'View': {'pic': f'https://i0.hdslb.com/bfs/archive/{id}.jpg', 'desc': f'description of video {id}'},
+            'Tags': [{'tag_name': f'tag {id%k}'} for k in (3, 7, 31)],
+        }
+
+    def info(self, params: t.Dict[str, int]) -> t.Dict[str, t.Any]:
+        mid = params['mid']
+        return {'name': f'author {mid}', 'sex': '保密', 'sign': '', 'face': f'https://i1.hdslb.com/bfs/face/{mid}.jpg'}
+
+    def view(self, params: t.Dict[str, int]) -> t.Dict[str, t.Any]:
+        id = params['aid']
+        return {'title': f'video {id}', 'pages': [{'cid': id, 'page': 1, 'part': ''}]}
+
+    def playurl(self, params: t.Dict[str, int]) -> t.Dict[str, t.Any]:
+        base = f'https://upos-sz-mirrorcos.bilivideo.com/upgcxcode/{params["cid"]}'
+        if self.server.segments:  # the durl form older videos come in: one flv, or consecutive pieces of it
+            return {'format': 'flv', 'durl': [
+                {'order': order, 'url': f'{base}/{order}.flv'} for order in range(1, self.server.segments+1)
+            ]}
+        return {'dash': {
+            'video': [
+                {'id': 80, 'codecid': codec, 'bandwidth': 1_000_000, 'baseUrl': f'{base}/80.{codec}.video.m4s'}
+                for codec in (7, 12)
+            ],
+            'audio': [{'id': 30280, 'bandwidth': 192_000, 'baseUrl': f'{base}/30280.audio.m4s'}],
+        }}
+
+    def image(self, path: str) -> None:
+        content = hashlib.sha256(path.encode()).digest() * 512  # 16 KiB, stable per URL
+        etag = f'"{hashlib.md5(content).hexdigest()}"'
+        if self.headers.get('If-None-Match') == etag:
+            return self.body(b'', 'image/jpeg', 304, {'ETag': etag})
+        self.body(content, 'image/jpeg', headers={'ETag': etag})
+
+    ROUTES: t.Dict[str, t.Callable[['Bilibili', t.Dict[str, int]], t.Any]] = {
+        '/x/v3/fav/resource/list': favorite,
+        '/x/web-interface/wbi/view/detail': detail,
+        '/x/space/wbi/acc/info': info,
+        '/x/web-interface/view': view,
+        '/x/player/playurl': playurl,
+    }
+
+
+class Server(hs.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self, latency: float = 0.0, handler: t.Type[Handler] = Handler,
+        files: t.Optional[t.Dict[str, bytes]] = None, throttle: float = 0.0, errors: float = 0.0,
+        videos: int = 1000, authors: int = 100, media: int = 1 << 20, segments: int = 0,
+    ) -> None:
+        super().__init__(('127.0.0.1', 0), handler)
+        self.latency = latency
+        self.files = files or {}
+        self.throttle = throttle  # share of API responses that are 412
+        self.errors = errors  # share of API responses that are 500
+        self.videos = videos
+        self.authors = authors
+        self.media = media  # bytes of each playurl stream
+        self.segments = segments  # playurl answers with this many durl segments instead of DASH
+        self._thread = th.Thread(target=self.serve_forever, daemon=True)
+
+    def __enter__(self) -> te.Self:
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args, **kwargs) -> None:
+        self.shutdown()
+        self.server_close()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+
+class Redirect(httpx.BaseTransport):
+    # keeps the path and query, swaps the origin: lib's hard-coded hosts all land on one Server
+    def __init__(self, url: str) -> None:
+        self._url = httpx.URL(url)
+        self._transport = httpx.HTTPTransport()
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        request.url = request.url.copy_with(scheme=self._url.scheme, host=self._url.host, port=self._url.port)
+        return self._transport.handle_request(request)
+
+    def close(self) -> None:
+        self._transport.close()
+
+
+class ARedirect(httpx.AsyncBaseTransport):
+    def __init__(self, url: str) -> None:
+        self._url = httpx.URL(url)
+        self._transport = httpx.AsyncHTTPTransport()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        request.url = request.url.copy_with(scheme=self._url.scheme, host=self._url.host, port=self._url.port)
+        return await self._transport.handle_async_request(request)
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
+
+
+def media(path: str, size: int) -> bytes:
+    # stable per URL, so a resumed download can be checked against a fresh copy
+    return random.Random(path).randbytes(size)
+
+
+def danmaku(seed: int, number: int = 200) -> bytes:
+    # a few hundred comments drawn from a small vocabulary, so term counts have a long tail
+    words = ['哈哈哈', '好看', '前方高能', '火钳刘明', '哔哩哔哩', '666', '来了', '这个', '视频', '真的', '太', '厉害', '了', '吧']
+    generator = random.Random(seed)
+    texts = (''.join(generator.choices(words, k=generator.randint(1, 6))) for _ in range(number))
+    body = ''.join(f'<d p="0,1,25,16777215,0,0,0,0">{text}</d>' for text in texts)
+    return f'<?xml version="1.0" encoding="UTF-8"?><i>{body}</i>'.encode()
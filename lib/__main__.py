@@ -1,46 +1,255 @@
+import datetime as d
+import pathlib as p
 import typing as t
 
 import click
 
+if t.TYPE_CHECKING:
+    from .local import Session
+
 
 @click.group()
-def cli() -> None:
-    pass
+@click.option('--report', type=click.Path(dir_okay=False, allow_dash=True), default=None,
+              help='Write stage timers, counters and histograms as JSON at exit (- for stderr).')
+@click.option('--profile', type=click.Path(dir_okay=False), default=None,
+              help='Write cProfile stats of the main thread at exit.')
+@click.pass_context
+def cli(ctx: click.Context, report: t.Optional[str], profile: t.Optional[str]) -> None:
+    if report is not None:
+        from .metrics import dump
+
+        ctx.call_on_close(lambda: dump(report))
+    if profile is not None:
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+        def close() -> None:
+            profiler.disable()
+            profiler.dump_stats(profile)
+
+        ctx.call_on_close(close)
 
 
 @cli.command()
 @click.argument('ids', nargs=-1)
 @click.option('--fast', '-f', is_flag=True, default=False)
-def sync(ids: t.Tuple[int, ...], fast: bool) -> None:
+@click.option('--downloads', '-d', default=4, help='Concurrent video downloads.')
+@click.option('--enrichers', '-e', default=4, help='Concurrent metadata/cover fetchers.')
+@click.option('--batch', '-b', default=64, help='Rows per database transaction.')
+@click.option('--danmaku/--no-danmaku', default=True, help='Count danmaku terms of new videos (needs jieba).')
+def sync(ids: t.Tuple[int, ...], fast: bool, downloads: int, enrichers: int, batch: int, danmaku: bool) -> None:
+    from importlib.util import find_spec
+
     from tqdm import tqdm
 
     from .local import Session
+    from .pipeline import Pipeline
     from .remote import Favorite
+    from .thumbnail import Thumbnailer
 
-    with Session() as session:
+    written = []
+    with Session() as session, Thumbnailer() as thumbnailer:
         for id in ids:
             favorite = Favorite(id)
-            for author, video in tqdm(favorite.videos(), desc=id, total=favorite.number()):
-                if not session.exists(video, 'id') and video.to_remote().download():
-                    assert session.add_if_not_exists(author.full(), 'id')
-                    assert session.add(video.full())
-                elif fast:
-                    break
+            pipeline = Pipeline(session, downloads, enrichers, fast, batch)
+            with tqdm(desc=id, total=favorite.number()) as bar:
+                pipeline.run(favorite.videos(), bar.update)
+            for instance in pipeline.failed:
+                click.echo(f'failed: {type(instance).__name__} {instance.id}', err=True)
+            thumbnailer.submit(_images(session, pipeline.written))  # resized while the next list syncs
+            written.extend(pipeline.written)
+    if danmaku and written and find_spec('jieba') is not None:
+        from .danmaku import index
+
+        click.echo(f'counted danmaku of {index(written)} video(s)', err=True)
 
 
 @cli.command()
-def ffmpeg():
-    from tqdm import tqdm
+@click.option('--workers', '-w', type=int, default=None, help='Resizing processes (default: CPUs).')
+def thumbnail(workers: t.Optional[int]) -> None:
+    from sqlalchemy.sql.expression import select
+
+    from .local import Session, Video
+    from .thumbnail import Thumbnailer
+
+    with Session() as session, Thumbnailer(workers) as thumbnailer:
+        thumbnailer.submit(_images(session, session.session.execute(select(Video.id)).scalars()))
+        number = thumbnailer.close()
+    click.echo(f'{number} thumbnail(s) in place', err=True)
+
+
+@cli.command()
+@click.argument('ids', nargs=-1, type=int)
+@click.option('--minimum', default=300.0, help='Shortest poll interval (s).')
+@click.option('--maximum', default=86400.0, help='Longest poll interval (s).')
+@click.option('--once', is_flag=True, default=False, help='Poll every list once and exit.')
+@click.option('--downloads', '-d', default=4, help='Concurrent video downloads.')
+@click.option('--enrichers', '-e', default=4, help='Concurrent metadata/cover fetchers.')
+@click.option('--batch', '-b', default=64, help='Rows per database transaction.')
+def watch(
+    ids: t.Tuple[int, ...], minimum: float, maximum: float, once: bool,
+    downloads: int, enrichers: int, batch: int,
+) -> None:
+    from .watch import Watcher
 
+    watcher = Watcher(ids, minimum, maximum, downloads, enrichers, batch, lambda message: click.echo(message, err=True))
+    try:
+        watcher.run(once)
+    except KeyboardInterrupt:
+        pass
+
+
+@cli.command()
+@click.argument('ids', nargs=-1, type=int)
+def reconcile(ids: t.Tuple[int, ...]) -> None:
+    from sqlalchemy.sql.expression import select
+
+    from .local import Favorite, Session
+    from .reconcile import reconcile, rescued
+
+    if not ids:  # every watched list
+        with Session() as session:
+            ids = tuple(session.session.execute(select(Favorite.id)).scalars())
+    for id in ids:
+        diff = reconcile(id)
+        click.echo(f'favorite {id}: +{len(diff.added)} -{len(diff.removed)}, {len(diff.unavailable)} unavailable', err=True)
+    for video, reason in rescued():
+        click.echo(f'{video.id}\t{reason}\t{video.title}')
+
+
+@cli.command()
+@click.option('--jobs', '-j', default=2, help='Concurrent ffmpeg processes.')
+@click.option('--budget', '-b', type=int, default=None, help='Total encoder threads (default: usable CPUs).')
+@click.option('--force', is_flag=True, default=False, help='Re-encode without probing first.')
+def ffmpeg(jobs: int, budget: t.Optional[int], force: bool) -> None:
     from .local import Session, Video
+    from .transcode import Scheduler
 
+    scheduler = Scheduler(jobs, budget, force)
     with Session() as session:
-        total = session.query(Video).count()
-        for video in tqdm(session.query(Video), total=total):
-            path = video.directory / 'ffmpeg.done'
-            if not path.exists():
-                assert video.to_remote().ffmpeg()
-                path.touch(exist_ok=True)
+        failed = scheduler.run(session.query(Video))
+    stats = scheduler.stats
+    click.echo(
+        f'skipped {stats["skip"]}, remuxed {stats["remux"]}, encoded {stats["encode"]}; '
+        f'read {stats["read"]/1048576:.1f} MiB, wrote {stats["written"]/1048576:.1f} MiB'
+    )
+    for video in failed:
+        click.echo(f'failed: {video.id} {video.directory}', err=True)
+    assert not failed
+
+
+@cli.command()
+@click.option('--workers', '-w', type=int, default=None, help='Hashing threads.')
+@click.option('--full', is_flag=True, default=False, help='Re-hash files whose size and mtime did not change.')
+@click.option('--probe', is_flag=True, default=False, help='Also check media files with ffprobe.')
+def verify(workers: t.Optional[int], full: bool, probe: bool) -> None:
+    from .verify import Verifier
+
+    problems = Verifier(workers, full, probe).run()
+    for problem in problems:
+        click.echo('\t'.join(filter(bool, problem)))
+    click.echo(f'{len(problems)} problem(s)', err=True)
+
+
+@cli.command()
+@click.option('--age', '-a', default=30.0, help='Refresh rows not refreshed for this many days.')
+@click.option('--concurrency', '-c', default=8, help='Requests in flight.')
+@click.option('--rate', '-r', default=4.0, help='API requests per second, across all workers.')
+@click.option('--batch', '-b', default=256, help='Rows per database transaction.')
+def refresh(age: float, concurrency: int, rate: float, batch: int) -> None:
+    import asyncio
+
+    from .refresh import run
+    from .util import limit
+
+    limit('api.bilibili.com', rate)
+    stats = asyncio.run(run(age*86400, concurrency, batch))
+    click.echo(', '.join(f'{key}: {value}' for key, value in sorted(stats.items())))
+
+
+@cli.command()
+@click.argument('query', nargs=-1)
+@click.option('--page', '-p', default=1)
+@click.option('--limit', '-l', default=20)
+@click.option('--danmaku', '-d', is_flag=True, default=False, help='Index danmaku of videos not indexed yet first.')
+def search(query: t.Tuple[str, ...], page: int, limit: int, danmaku: bool) -> None:
+    from .search import index_danmaku, search
+
+    if danmaku:
+        click.echo(f'indexed danmaku of {index_danmaku()} video(s)', err=True)
+    if query:
+        total, hits = search(' '.join(query), limit=limit, offset=(page-1)*limit)
+        for hit in hits:
+            click.echo(f'{hit.id}\t{hit.author}\t{hit.title}')
+        click.echo(f'page {page}/{-(-total//limit)}, {total} result(s)', err=True)
+
+
+@cli.command()
+@click.option('--workers', '-w', type=int, default=None, help='Tokenizer processes (default: CPUs).')
+@click.option('--rebuild', is_flag=True, default=False, help='Recount every video, e.g. after changing WORDS.')
+def danmaku(workers: t.Optional[int], rebuild: bool) -> None:
+    from sqlalchemy.sql.expression import delete
+
+    from .danmaku import index
+    from .local import Danmaku, Session
+
+    if rebuild:
+        with Session() as session:
+            session.session.execute(delete(Danmaku))
+            session.session.commit()
+    click.echo(f'counted danmaku of {index(workers=workers)} video(s)', err=True)
+
+
+@cli.command()
+@click.option('--limit', '-l', default=50)
+@click.option('--author', '-a', type=int, default=None, help='Author id.')
+@click.option('--tag', '-t', default=None)
+@click.option('--since', '-s', type=click.DateTime(), default=None, help='Earliest video timestamp.')
+@click.option('--until', '-u', type=click.DateTime(), default=None, help='Latest video timestamp (exclusive).')
+@click.option('--exclude', '-x', type=click.File(), default=None, help='File of stopwords, one per line.')
+def terms(
+    limit: int, author: t.Optional[int], tag: t.Optional[str], since: t.Optional[d.datetime],
+    until: t.Optional[d.datetime], exclude: t.Optional[t.TextIO],
+) -> None:
+    from .danmaku import top
+
+    for text, count in top(
+        limit, author, tag,
+        since and int(since.timestamp()), until and int(until.timestamp()),
+        exclude=exclude.read().splitlines() if exclude else (),
+    ):
+        click.echo(f'{count}\t{text}')
+
+
+@cli.command('id')
+@click.argument('ids', nargs=-1)
+def id_(ids: t.Tuple[str, ...]) -> None:
+    # aid, av…, BV… or a video url, from the arguments or one per line on stdin
+    import sys
+
+    from .bvid import bvs, parse
+
+    texts = ids or [line for line in sys.stdin.read().splitlines() if line.strip()]
+    try:
+        aids = [parse(text) for text in texts]
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='IDS')
+    for aid, bvid in zip(aids, bvs(aids)):
+        click.echo(f'{aid}\t{bvid}')
+
+
+@cli.command()
+@click.option('--host', '-h', default=None)
+@click.option('--port', '-p', type=int, default=None)
+def serve(host: t.Optional[str], port: t.Optional[int]) -> None:
+    from .config import MEDIA_HOST, MEDIA_PORT, MEDIA_SECRET
+    from .serve import Server
+
+    # without MEDIA_SECRET (the app's) files of videos that are not public are never served
+    with Server(host or MEDIA_HOST, port or MEDIA_PORT, MEDIA_SECRET) as server:
+        server.serve_forever()
 
 
 @cli.command()
@@ -56,19 +265,54 @@ def login(driver: t.Literal['Chrome', 'Edge', 'Firefox', 'Safari']) -> None:
     browser.get('https://passport.bilibili.com/login')
     input('Please login in >>> ')
     cookies = {item['name']: item['value'] for item in browser.get_cookies()}
+    COOKIES.parent.mkdir(parents=True, exist_ok=True)
     COOKIES.write_text(json.dumps(cookies))
 
 
+@cli.command()
+@click.option('--dry-run', '-n', is_flag=True, default=False, help='Only list the pending migrations.')
+def migrate(dry_run: bool) -> None:
+    from sqlalchemy.engine import create_engine
+
+    from .config import DATABASE
+    from .local import engine
+    from .migrate import MIGRATIONS, pending
+
+    # a bare engine: local.engine() would create the tables and migrate on connect
+    migrations = pending(create_engine(f'sqlite:///{DATABASE}')) if DATABASE.exists() else MIGRATIONS
+    for migration in migrations:
+        click.echo(f'{migration.version}\t{migration.name}')
+    if not dry_run:
+        engine()
+        click.echo(f'applied {len(migrations)} migration(s)', err=True)
+
+
 @cli.command()
 def clean() -> None:
     import shutil
 
-    from .config import COOKIES, DATABASE, DOWNLOAD_AVATAR, DOWNLOAD_COVER, DOWNLOAD_VIDEO
+    from .config import (
+        COOKIES, DATABASE, DOWNLOAD_AVATAR, DOWNLOAD_BLOB, DOWNLOAD_COVER, DOWNLOAD_THUMBNAIL, DOWNLOAD_VIDEO,
+    )
 
-    for directory in [DOWNLOAD_AVATAR, DOWNLOAD_COVER, DOWNLOAD_VIDEO]:
+    for directory in [DOWNLOAD_AVATAR, DOWNLOAD_BLOB, DOWNLOAD_COVER, DOWNLOAD_THUMBNAIL, DOWNLOAD_VIDEO]:
         shutil.rmtree(directory, ignore_errors=True)
     for path in [COOKIES, DATABASE]:
         path.unlink(missing_ok=True)
 
 
-cli.main()
+def _images(session: 'Session', ids: t.Iterable[int]) -> t.List[p.Path]:
+    from sqlalchemy.sql.expression import select
+
+    from .local import Author, Video
+
+    ids = list(ids)
+    authors = set()
+    for ith in range(0, len(ids), 512):
+        query = select(Video.author_id).where(Video.id.in_(ids[ith:ith+512]))
+        authors.update(session.session.execute(query).scalars())
+    return [Video._cover(id) for id in ids] + [Author._avatar(id) for id in authors if id is not None]
+
+
+if __name__ == '__main__':
+    cli.main()
@@ -0,0 +1,155 @@
+import array
+import hashlib
+import pathlib as p
+import random
+import typing as t
+
+from sqlalchemy.sql.expression import select
+
+from .bvid import url
+from .config import DATABASE
+from .local import Author, Session, Video, VideoTag
+
+
+class Entry(t.NamedTuple):
+    id: int
+    title: str
+    timestamp: int
+    tags: str
+    description: str
+    author: str
+
+    @property
+    def cover(self) -> p.Path:
+        return Video._cover(self.id)
+
+    @property
+    def directory(self) -> p.Path:
+        return Video._directory(self.id)
+
+    @property
+    def url(self) -> str:
+        return url(self.id)
+
+
+class Part(t.NamedTuple):
+    stem: str
+    path: str
+    size: int
+
+
+def version() -> t.Tuple[int, ...]:
+    # WAL writes touch only the -wal file until a checkpoint, so both count
+    paths = [DATABASE, DATABASE.with_name(f'{DATABASE.name}-wal')]
+    return tuple(path.stat().st_mtime_ns if path.exists() else 0 for path in paths)
+
+
+class Catalog:
+    # column-oriented snapshot of the video table, newest first; rebuilt when version() changes
+    def __init__(self, public: bool) -> None:
+        query = select(
+            Video.id, Video.title, Video.timestamp, Video.tags, Video.description, Author.name,
+        ).outerjoin(Author, Video.author_id == Author.id) \
+            .where(Video.public == public) \
+            .order_by(Video.id.desc())
+        with Session() as session:
+            columns = list(zip(*session.session.execute(query))) or [()] * 6
+        self.ids = array.array('q', columns[0])
+        self.titles: t.List[str] = list(columns[1])
+        self.timestamps = array.array('q', columns[2])
+        self.tags: t.List[str] = [value or '' for value in columns[3]]
+        self.descriptions: t.List[str] = [value or '' for value in columns[4]]
+        self.authors: t.List[str] = [value or '' for value in columns[5]]
+        self._positions = {id: ith for ith, id in enumerate(self.ids)}
+        self._parts: t.Dict[int, t.List[Part]] = {}
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def entry(self, ith: int) -> Entry:
+        return Entry(
+            self.ids[ith], self.titles[ith], self.timestamps[ith],
+            self.tags[ith], self.descriptions[ith], self.authors[ith],
+        )
+
+    def position(self, id: int) -> int:
+        return self._positions[id]
+
+    def parts(self, id: int) -> t.List[Part]:
+        if id not in self._parts:
+            self._parts[id] = sorted(
+                Part(path.stem, path.as_posix(), path.stat().st_size)
+                for path in Video._directory(id).glob('*.mp4')
+            )
+        return self._parts[id]
+
+
+class Shuffle:
+    # keyed permutation of range(n): a seed stands in for a shuffled copy of n keys
+    # (a balanced Feistel network over the next power of 4, cycle-walking until the value is below n)
+    ROUNDS = 4
+
+    def __init__(self, seed: int, n: int) -> None:
+        generator = random.Random(seed)
+        self._n = max(1, n)
+        self._half = max(1, ((self._n-1).bit_length()+1) // 2)
+        self._mask = (1 << self._half) - 1
+        self._keys = [generator.getrandbits(64).to_bytes(8, 'little') for _ in range(self.ROUNDS)]
+
+    def __len__(self) -> int:
+        return self._n
+
+    def __getitem__(self, ith: int) -> int:
+        ans = self._forward(ith % self._n)
+        while ans >= self._n:
+            ans = self._forward(ans)
+        return ans
+
+    def index(self, position: int) -> int:
+        ans = self._backward(position)
+        while ans >= self._n:
+            ans = self._backward(ans)
+        return ans
+
+    def _forward(self, value: int) -> int:
+        left, right = value >> self._half, value & self._mask
+        for key in self._keys:
+            left, right = right, left ^ self._round(right, key)
+        return left << self._half | right
+
+    def _backward(self, value: int) -> int:
+        left, right = value >> self._half, value & self._mask
+        for key in reversed(self._keys):
+            left, right = right ^ self._round(left, key), left
+        return left << self._half | right
+
+    def _round(self, value: int, key: bytes) -> int:
+        digest = hashlib.blake2b(value.to_bytes(8, 'little'), digest_size=8, key=key).digest()
+        return int.from_bytes(digest, 'little') & self._mask
+
+
+def browse(
+    public: bool, size: int = 20, before: t.Optional[int] = None,
+    author: str = '', tag: str = '', since: t.Optional[int] = None, until: t.Optional[int] = None,
+) -> t.List[Entry]:
+    # one page, newest first; the next page starts before the last id of this one (keyset, no OFFSET)
+    query = select(
+        Video.id, Video.title, Video.timestamp, Video.tags, Video.description, Author.name,
+    ).outerjoin(Author, Video.author_id == Author.id) \
+        .where(Video.public == public)
+    if before is not None:
+        query = query.where(Video.id < before)
+    if author:
+        query = query.where(Author.name.contains(author, autoescape=True))
+    if tag:
+        query = query.where(Video.id.in_(VideoTag.videos(tag)))
+    if since is not None:
+        query = query.where(Video.timestamp >= since)
+    if until is not None:
+        query = query.where(Video.timestamp < until)
+    with Session() as session:
+        rows = session.session.execute(query.order_by(Video.id.desc()).limit(size))
+        return [
+            Entry(id, title, timestamp, tags or '', description or '', name or '')
+            for id, title, timestamp, tags, description, name in rows
+        ]
@@ -1,9 +1,12 @@
+import os
 import pathlib as p
 
 
 DOWNLOAD = p.Path('data')
 DOWNLOAD_AVATAR = DOWNLOAD / 'avatar'
+DOWNLOAD_BLOB = DOWNLOAD / 'blob'
 DOWNLOAD_COVER = DOWNLOAD / 'cover'
+DOWNLOAD_THUMBNAIL = DOWNLOAD / 'thumbnail'
 DOWNLOAD_VIDEO = DOWNLOAD / 'video'
 COOKIES = DOWNLOAD / 'cookies.json'
 DATABASE = DOWNLOAD / 'db.sqlite'
@@ -11,6 +14,15 @@ HEADERS = {
     'Referer': 'https://www.bilibili.com/',
     'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/117.0.0.0 Safari/537.36',
 }
-
-for directory in [DOWNLOAD_AVATAR, DOWNLOAD_COVER, DOWNLOAD_VIDEO]:
-    directory.mkdir(parents=True, exist_ok=True)
+WORDS = {'哔哩哔哩', '火钳刘明'}  # extra jieba dictionary entries for danmaku
+# the media server the app streams parts from: where it binds, and the base url browsers reach it at
+# (set MEDIA_URL too when binding anything but localhost); MEDIA_SECRET signs urls of videos that are
+# not public, shared by `lib serve` and the app when they run as separate processes
+MEDIA_HOST = os.environ.get('MEDIA_HOST', '127.0.0.1')
+MEDIA_PORT = int(os.environ.get('MEDIA_PORT', '8502'))
+MEDIA_URL = os.environ.get('MEDIA_URL', f'http://{MEDIA_HOST}:{MEDIA_PORT}')
+MEDIA_SECRET = os.environ.get('MEDIA_SECRET', '').encode() or None
+RATES = {  # host (or parent domain): (requests per second, burst)
+    'api.bilibili.com': (4.0, 4),
+    'hdslb.com': (16.0, 16),
+}
@@ -0,0 +1,129 @@
+import collections as c
+import concurrent.futures as cf
+import pathlib as p
+import typing as t
+import xml.etree.ElementTree as et
+
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.sql.expression import delete, func, select
+
+from .config import WORDS
+from .local import Danmaku, Session, Term, Video, VideoTag, VideoTerm
+
+
+Job = t.Tuple[int, int, t.List[p.Path]]  # video id, newest mtime, xml paths
+
+
+class XML:
+    def __init__(self, path: p.Path) -> None:
+        self._path = path
+
+    def texts(self) -> t.Iterator[str]:
+        # streaming: each <d> is dropped right after it is read
+        for _, element in et.iterparse(self._path.as_posix()):
+            if element.tag == 'd' and element.text:
+                yield element.text
+            element.clear()
+
+    def tokens(self) -> t.Iterator[str]:
+        import jieba
+
+        for text in self.texts():
+            yield from jieba.cut(text)
+
+
+def count(paths: t.List[p.Path]) -> t.Counter[str]:
+    ans: t.Counter[str] = c.Counter()
+    for path in paths:
+        ans.update(token for token in XML(path).tokens() if token.strip())
+    return ans
+
+
+def index(ids: t.Optional[t.Iterable[int]] = None, workers: t.Optional[int] = None, batch: int = 64) -> int:
+    with Session() as session:
+        jobs = list(_stale(session, ids))
+        if not jobs:
+            return 0
+        terms: t.Dict[str, int] = dict(session.session.execute(select(Term.text, Term.id)).all())
+        pending: t.List[t.Tuple[Job, t.Counter[str]]] = []
+        with cf.ProcessPoolExecutor(workers, initializer=_setup) as executor:
+            for job, counter in zip(jobs, executor.map(count, [job[2] for job in jobs], chunksize=4)):
+                pending.append((job, counter))
+                if len(pending) >= batch:
+                    _write(session, terms, pending)
+                    pending = []
+        _write(session, terms, pending)
+    return len(jobs)
+
+
+def top(
+    limit: int = 100, author: t.Optional[int] = None, tag: t.Optional[str] = None,
+    since: t.Optional[int] = None, until: t.Optional[int] = None,
+    public: t.Optional[bool] = None, exclude: t.Iterable[str] = (),
+) -> t.List[t.Tuple[str, int]]:
+    total = func.sum(VideoTerm.count).label('total')
+    query = select(Term.text, total) \
+        .join(Term, Term.id == VideoTerm.term_id) \
+        .join(Video, Video.id == VideoTerm.video_id)
+    if author is not None:
+        query = query.where(Video.author_id == author)
+    if tag is not None:
+        query = query.where(Video.id.in_(VideoTag.videos(tag)))
+    if since is not None:
+        query = query.where(Video.timestamp >= since)
+    if until is not None:
+        query = query.where(Video.timestamp < until)
+    if public is not None:
+        query = query.where(Video.public == public)
+    # stopwords are dropped here rather than bound as NOT IN parameters, which can pass SQLite's variable limit;
+    # each one hides at most one row, so limit + len(exclude) rows are always enough
+    exclude = set(exclude)
+    query = query.group_by(VideoTerm.term_id).order_by(total.desc()).limit(limit+len(exclude))
+    with Session() as session:
+        rows = session.session.execute(query)
+        return [tuple(row) for row in rows if row[0] not in exclude][:limit]
+
+
+def _setup() -> None:
+    import jieba
+
+    jieba.setLogLevel(60)
+    list(map(jieba.add_word, WORDS))
+
+
+def _stale(session: Session, ids: t.Optional[t.Iterable[int]]) -> t.Iterator[Job]:
+    done = dict(session.session.execute(select(Danmaku.video_id, Danmaku.mtime)).all())
+    if ids is None:
+        ids = session.session.execute(select(Video.id)).scalars()
+    for id in ids:
+        paths = sorted(Video._directory(id).glob('*.xml'))
+        mtime = max((path.stat().st_mtime_ns for path in paths), default=0)
+        if paths and done.get(id) != mtime:
+            yield id, mtime, paths
+
+
+def _write(session: Session, terms: t.Dict[str, int], pending: t.List[t.Tuple[Job, t.Counter[str]]]) -> None:
+    if not pending:
+        return
+    new = sorted({text for _, counter in pending for text in counter if text not in terms})
+    for ith in range(0, len(new), 512):  # bound in IN (...): SQLite before 3.32 allows 999 variables
+        chunk = new[ith:ith+512]
+        session.session.execute(insert(Term).on_conflict_do_nothing(), [{'text': text} for text in chunk])
+        terms.update(session.session.execute(select(Term.text, Term.id).where(Term.text.in_(chunk))).all())
+    ids = [job[0] for job, _ in pending]
+    session.session.execute(delete(VideoTerm).where(VideoTerm.video_id.in_(ids)))
+    rows = [
+        {'video_id': job[0], 'term_id': terms[text], 'count': number}
+        for job, counter in pending for text, number in counter.items()
+    ]
+    if rows:
+        session.session.execute(insert(VideoTerm), rows)
+    statement = insert(Danmaku)
+    session.session.execute(
+        statement.on_conflict_do_update(
+            index_elements=['video_id'],
+            set_={'mtime': statement.excluded.mtime, 'tokens': statement.excluded.tokens},
+        ),
+        [{'video_id': job[0], 'mtime': job[1], 'tokens': sum(counter.values())} for job, counter in pending],
+    )
+    session.session.commit()
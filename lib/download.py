@@ -0,0 +1,209 @@
+import concurrent.futures as cf
+import json
+import pathlib as p
+import re
+import subprocess as sp
+import threading as th
+import typing as t
+
+from .metrics import count, observe, timer
+from .util import client, get, retrying
+
+
+CHUNK = 8 << 20
+MANIFEST = 'manifest.json'
+
+Stream = t.Dict[str, t.Any]  # kind (video, audio or segment), file, url, size, done (finished chunk indices)
+Part = t.Dict[str, t.Any]  # cid, name, streams, muxed, done
+
+
+class Incomplete(Exception):
+    pass
+
+
+class Downloader:
+    def __init__(self, id: int, directory: p.Path, connections: int = 4) -> None:
+        self._id = id
+        self._directory = directory
+        self._connections = connections
+        self._lock = th.Lock()
+        self._manifest: t.Dict[str, t.Any] = {'id': id, 'parts': [], 'complete': False}
+
+    @property
+    def manifest(self) -> p.Path:
+        return self._directory / MANIFEST
+
+    def complete(self) -> bool:
+        if self.manifest.exists():
+            return json.loads(self.manifest.read_text()).get('complete', False)
+        return self._directory.exists()  # downloaded by you-get, before manifests existed
+
+    def run(self) -> bool:
+        if self.complete():
+            return True
+        try:
+            self._run()
+        except Exception:
+            return False  # partial data and the manifest stay behind for the next attempt
+        return True
+
+    def fetch(self, streams: t.List[Stream]) -> None:
+        for stream in streams:
+            path = self._path(stream)
+            if not path.exists() or path.stat().st_size != stream['size']:
+                with path.open('ab') as file:
+                    file.truncate(stream['size'])
+                stream['done'] = []  # whatever the manifest says, these bytes are not known to be there
+        pending = [
+            (stream, ith) for stream in streams
+            for ith in range(-(-stream['size']//CHUNK))
+            if ith not in stream['done']
+        ]
+        with cf.ThreadPoolExecutor(self._connections) as executor:
+            futures = [executor.submit(self._chunk, stream, ith) for stream, ith in pending]
+            try:
+                for future in cf.as_completed(futures):
+                    future.result()
+            except BaseException:
+                executor.shutdown(wait=True, cancel_futures=True)
+                raise
+
+    def _run(self) -> None:
+        if self.manifest.exists():
+            self._manifest = json.loads(self.manifest.read_text())
+        else:
+            # resolved first: a directory without a manifest reads as a finished you-get download
+            parts = self._parts()
+            self._directory.mkdir(parents=True, exist_ok=True)
+            self._manifest['parts'] = parts
+            self._save()
+        for part in self._manifest['parts']:
+            if not part['done']:
+                if not part.get('muxed', False):
+                    self._streams(part)  # playurl links expire, so they are resolved on every attempt
+                    self._save()
+                    self.fetch(part['streams'])
+                    self._mux(part)
+                self._danmaku(part)
+                part['done'] = True
+                self._save()
+        self._manifest['complete'] = True
+        self._save()
+
+    def _parts(self) -> t.List[Part]:
+        data = _api('https://api.bilibili.com/x/web-interface/view', aid=self._id)
+        pages = data['pages']
+        return [
+            {
+                'cid': page['cid'],
+                'name': _name(data['title'] if len(pages) == 1 else f'{data["title"]} (P{page["page"]}. {page["part"]})'),
+                'streams': [], 'muxed': False, 'done': False,
+            } for page in pages
+        ]
+
+    def _streams(self, part: Part) -> None:
+        data = _api('https://api.bilibili.com/x/player/playurl', avid=self._id, cid=part['cid'], fnval=16, fourk=1)
+        old = {stream['file']: stream for stream in part['streams']}
+        part['streams'] = []
+        for kind, file, url in _dash(part, data['dash']) if data.get('dash') else _durl(part, data):
+            stream = {'kind': kind, 'file': file, 'url': url, 'size': self._size(url), 'done': []}
+            if file in old and old[file]['size'] == stream['size']:
+                stream['done'] = old[file]['done']
+            part['streams'].append(stream)
+
+    def _mux(self, part: Part) -> None:
+        target = self._directory / f'{part["name"]}.mp4'
+        temp = target.with_name(f'.{target.name}.part')
+        segments = [stream for stream in part['streams'] if stream['kind'] == 'segment']
+        concat = self._directory / f'{part["cid"]}.concat.txt'
+        if len(segments) > 1:
+            # segments of a durl answer are pieces of one file: joined by ffmpeg's concat demuxer, which
+            # reads the names relative to the list
+            concat.write_text(''.join(f"file '{stream['file']}'\n" for stream in segments))
+            inputs = ['-f', 'concat', '-safe', '0', '-i', concat]
+        else:
+            inputs = [arg for stream in part['streams'] for arg in ('-i', self._path(stream))]
+        args = [
+            'ffmpeg', '-y', '-nostdin', '-v', 'error', *inputs,
+            '-c', 'copy', '-movflags', 'faststart', '-f', 'mp4', temp,
+        ]
+        with timer('download mux'):
+            code = sp.run(args, capture_output=True).returncode
+        concat.unlink(missing_ok=True)
+        if code != 0:
+            temp.unlink(missing_ok=True)
+            raise Incomplete(f'ffmpeg could not mux {target}')
+        temp.replace(target)
+        # recorded before the streams go, so a retry after a failed danmaku fetch does not download into zeros
+        part['muxed'] = True
+        self._save()
+        for stream in part['streams']:
+            self._path(stream).unlink(missing_ok=True)
+
+    def _danmaku(self, part: Part) -> None:
+        response = get('https://api.bilibili.com/x/v1/dm/list.so', params={'oid': part['cid']})
+        (self._directory / f'{part["name"]}.cmt.xml').write_bytes(response.content)
+
+    @retrying
+    def _chunk(self, stream: Stream, ith: int) -> None:
+        start = ith * CHUNK
+        end = min(stream['size'], start+CHUNK) - 1
+        headers = {'Range': f'bytes={start}-{end}'}
+        with client().stream('GET', stream['url'], headers=headers) as response:
+            if response.status_code != 206:
+                raise Incomplete(f'{response.status_code} for {headers["Range"]}')
+            with self._path(stream).open('r+b') as file:
+                file.seek(start)
+                for data in response.iter_bytes(1 << 16):
+                    file.write(data)
+                if file.tell() != end + 1:
+                    raise Incomplete(f'got {file.tell()-start} of {end+1-start} bytes')
+        count('download bytes', end+1-start)
+        observe('download bytes', self._id, end+1-start)
+        with self._lock:
+            stream['done'].append(ith)
+            self._save()
+
+    @retrying
+    def _size(self, url: str) -> int:
+        with client().stream('GET', url, headers={'Range': 'bytes=0-0'}) as response:
+            if response.status_code != 206:
+                raise Incomplete(f'{response.status_code}: no range support')
+            return int(response.headers['Content-Range'].rpartition('/')[2])
+
+    def _path(self, stream: Stream) -> p.Path:
+        return self._directory / stream['file']
+
+    def _save(self) -> None:
+        temp = self.manifest.with_name(f'.{MANIFEST}.part')
+        temp.write_text(json.dumps(self._manifest, ensure_ascii=False))
+        temp.replace(self.manifest)
+
+
+def _api(url: str, **params: t.Any) -> t.Dict[str, t.Any]:
+    payload = get(url, params=params).json()
+    if payload['code'] != 0:
+        raise Incomplete(f'{url}: {payload["code"]} {payload["message"]}')
+    return payload['data']
+
+
+def _dash(part: Part, dash: t.Dict[str, t.Any]) -> t.Iterator[t.Tuple[str, str, str]]:
+    # prefer AVC (codecid 7): it is what lib ffmpeg can keep without re-encoding
+    choices = {'video': max(dash['video'], key=lambda s: (s['codecid'] == 7, s['id'], s['bandwidth']))}
+    if dash.get('audio'):
+        choices['audio'] = max(dash['audio'], key=lambda s: s['bandwidth'])
+    for kind, choice in choices.items():
+        yield kind, f'{part["cid"]}.{kind}.m4s', choice.get('baseUrl') or choice['base_url']
+
+
+def _durl(part: Part, data: t.Dict[str, t.Any]) -> t.Iterator[t.Tuple[str, str, str]]:
+    # older videos only come as one muxed flv/mp4 file, or as consecutive segments of one
+    if not data.get('durl'):
+        raise Incomplete(f'no dash or durl streams for part {part["cid"]}')
+    extension = 'mp4' if data.get('format', '').startswith('mp4') else 'flv'
+    for segment in sorted(data['durl'], key=lambda segment: segment['order']):
+        yield 'segment', f'{part["cid"]}.{segment["order"]}.{extension}', segment['url']
+
+
+def _name(value: str) -> str:
+    return re.sub(r'[\\/:*?"<>|]', '-', value).strip()
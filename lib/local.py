@@ -1,28 +1,63 @@
+import array
+import bisect
+import functools as f
 import pathlib as p
+import threading as th
+import time
 import typing as t
 
 import typing_extensions as te
 
-from sqlalchemy.engine import create_engine
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.engine import Engine, create_engine
+from sqlalchemy.event import listens_for
 from sqlalchemy.orm import declarative_base, relationship, sessionmaker
+from sqlalchemy.sql.expression import select, update
 from sqlalchemy.sql.schema import Column, ForeignKey
-from sqlalchemy.sql.sqltypes import Boolean, Integer, String
+from sqlalchemy.sql.sqltypes import Boolean, Float, Integer, String
 
 from .config import DATABASE, DOWNLOAD_AVATAR, DOWNLOAD_COVER, DOWNLOAD_VIDEO
-from .util import get
+from .metrics import count, timer
+from .migrate import migrate
 
 if t.TYPE_CHECKING:
     from .remote import Video as RemoteVideo
 
 
 Base = declarative_base()
-engine = create_engine(f'sqlite:///{DATABASE}')
+PRAGMAS = [
+    'journal_mode=WAL',
+    'synchronous=NORMAL',
+    'temp_store=MEMORY',
+    'cache_size=-65536',
+    'mmap_size=268435456',
+    'busy_timeout=5000',
+]
+
+
+@f.lru_cache(maxsize=None)
+def engine() -> Engine:
+    # created, and the schema checked, on first use rather than on import
+    DATABASE.parent.mkdir(parents=True, exist_ok=True)
+    ans = create_engine(f'sqlite:///{DATABASE}')
+    listens_for(ans, 'connect')(_pragma)
+    Base.metadata.create_all(ans, checkfirst=True)
+    migrate(ans)
+    return ans
+
+
+def _pragma(connection: t.Any, record: t.Any) -> None:
+    cursor = connection.cursor()
+    for pragma in PRAGMAS:
+        cursor.execute(f'PRAGMA {pragma}')
+    cursor.close()
 
 
 class Session:
     def __init__(self) -> None:
-        self.session = sessionmaker(bind=engine)()
+        self.session = sessionmaker(bind=engine())()
         self.query = self.session.query
+        self._known: t.Dict[t.Type[Base], IdSet] = {}
 
     def __enter__(self) -> te.Self:
         return self
@@ -37,10 +72,17 @@ class Session:
             self.query(Type).filter(*criterions).exists()
         ).scalar()
 
+    def known(self, Type: t.Type[Base]) -> 'IdSet':
+        if Type not in self._known:
+            ids = self.session.execute(select(Type.id).order_by(Type.id)).scalars()
+            self._known[Type] = IdSet(ids, sort=False)
+        return self._known[Type]
+
     def add(self, instance: Base) -> bool:
         try:
             self.session.add(instance)
             self.session.commit()
+            self._learn(instance)
             return True
         except Exception:
             self.session.rollback()
@@ -53,11 +95,126 @@ class Session:
         try:
             self.session.add_all(instances)
             self.session.commit()
+            self._learn(*instances)
             return True
         except Exception:
             self.session.rollback()
             return False
 
+    def batch(self, size: int = 64, interval: float = 5.0) -> 'Batch':
+        return Batch(self, size, interval)
+
+    def upsert(self, *instances: Base) -> t.List[Base]:
+        # one transaction for all, then row by row only to single out the failed ones
+        try:
+            self._upsert(instances)
+            self.session.commit()
+            self._learn(*instances)
+            return []
+        except Exception:
+            self.session.rollback()
+        ans = []
+        for instance in instances:
+            try:
+                self._upsert([instance])
+                self.session.commit()
+                self._learn(instance)
+            except Exception:
+                self.session.rollback()
+                ans.append(instance)
+        return ans
+
+    def _upsert(self, instances: t.Sequence[Base]) -> None:
+        groups: t.Dict[t.Tuple[t.Type[Base], t.FrozenSet[str]], t.List[t.Dict[str, t.Any]]] = {}
+        for instance in instances:
+            row = {
+                column.key: getattr(instance, column.key)
+                for column in type(instance).__table__.columns
+                if getattr(instance, column.key) is not None
+            }
+            groups.setdefault((type(instance), frozenset(row)), []).append(row)
+        order = Base.metadata.sorted_tables
+        for (Type, keys), rows in sorted(groups.items(), key=lambda item: order.index(item[0][0].__table__)):
+            table = Type.__table__
+            primary = [column.key for column in table.primary_key]
+            required = {
+                column.key for column in table.columns
+                if not column.nullable and column.default is None and not column.primary_key
+            }
+            if required - keys:  # partial rows (e.g. a refresh) can only update
+                self.session.execute(update(Type), rows)
+                continue
+            statement = insert(table)
+            update_ = {key: statement.excluded[key] for key in keys if key not in primary}
+            if update_:
+                statement = statement.on_conflict_do_update(index_elements=primary, set_=update_)
+            else:
+                statement = statement.on_conflict_do_nothing(index_elements=primary)
+            self.session.execute(statement, rows)
+
+    def _learn(self, *instances: Base) -> None:
+        for instance in instances:
+            known = self._known.get(type(instance))
+            if known is not None:
+                known.add(instance.id)
+
+
+class IdSet:
+    # sorted int64 array: ~8 bytes per id instead of a few dozen for a set of ints
+    def __init__(self, ids: t.Iterable[int] = (), sort: bool = True) -> None:
+        self._ids = array.array('q', sorted(ids) if sort else ids)
+        self._lock = th.Lock()
+
+    def __contains__(self, id: int) -> bool:
+        ith = bisect.bisect_left(self._ids, id)
+        return ith < len(self._ids) and self._ids[ith] == id
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __iter__(self) -> t.Iterator[int]:
+        return iter(self._ids)
+
+    def add(self, id: int) -> None:
+        with self._lock:
+            ith = bisect.bisect_left(self._ids, id)
+            if ith == len(self._ids) or self._ids[ith] != id:
+                self._ids.insert(ith, id)
+
+
+class Batch:
+    def __init__(self, session: Session, size: int, interval: float) -> None:
+        self._session = session
+        self._size = size
+        self._interval = interval
+        self._pending: t.List[Base] = []
+        self._time = time.monotonic()
+        self.failed: t.List[Base] = []
+
+    def __enter__(self) -> te.Self:
+        return self
+
+    def __exit__(self, *args, **kwargs) -> None:
+        self.flush()
+
+    def put(self, *instances: Base) -> t.List[Base]:
+        self._pending.extend(instances)
+        return self.flush() if len(self._pending) >= self._size else self.tick()
+
+    def tick(self) -> t.List[Base]:
+        return self.flush() if time.monotonic()-self._time >= self._interval else []
+
+    def flush(self) -> t.List[Base]:
+        pending, self._pending = self._pending, []
+        self._time = time.monotonic()
+        if not pending:
+            return []
+        with timer('db flush'):
+            ans = self._session.upsert(*pending)
+        count('db rows', len(pending)-len(ans))
+        count('db failed', len(ans))
+        self.failed.extend(ans)
+        return ans
 
 
 class Author(Base):
@@ -67,6 +224,7 @@ class Author(Base):
     name = Column(String(32), nullable=False)
     sex = Column(String(4), default='保密')
     sign = Column(String(128), default='')
+    refreshed = Column(Integer)
 
     @classmethod
     def fromDict(cls, data: t.Dict) -> te.Self:
@@ -85,15 +243,44 @@ class Author(Base):
         except Exception:
             return self
         else:
-            return self.__class__(id=self.id, name=self.name, **kwargs)
+            return self.__class__(id=self.id, **kwargs)
 
     @classmethod
     def _others(cls, id: int) -> t.Dict[str, t.Any]:
-        url = 'https://api.bilibili.com/x/space/wbi/acc/info'
-        params = {'mid': id}
-        data = get(url, params=params).json()['data']
-        cls._avatar(id).write_bytes(get(data['face']).content)
-        return {'sex': data['sex'], 'sign': data['sign']}
+        from .media import fetch
+        from .util import get
+
+        url, params = cls._request(id)
+        data = cls._data(get(url, params=params).json())
+        fetch(data['face'], cls._avatar(id))
+        return cls._parse(data)
+
+    @classmethod
+    async def _aothers(cls, id: int) -> t.Dict[str, t.Any]:
+        from .media import afetch
+        from .util import aget
+
+        url, params = cls._request(id)
+        data = cls._data((await aget(url, params=params)).json())
+        await afetch(data['face'], cls._avatar(id))
+        return cls._parse(data)
+
+    @staticmethod
+    def _request(id: int) -> t.Tuple[str, t.Dict[str, t.Any]]:
+        return 'https://api.bilibili.com/x/space/wbi/acc/info', {'mid': id}
+
+    @staticmethod
+    def _data(payload: t.Dict) -> t.Dict:
+        if payload['code'] != 0:
+            raise ValueError(f'{payload["code"]} {payload["message"]}')
+        return payload['data']
+
+    @staticmethod
+    def _parse(data: t.Dict) -> t.Dict[str, t.Any]:
+        return {
+            'name': data['name'], 'sex': data['sex'], 'sign': data['sign'],
+            'refreshed': int(time.time()),
+        }
 
     @staticmethod
     def _avatar(id: int) -> p.Path:
@@ -110,6 +297,8 @@ class Video(Base):
     description = Column(String(512), default='')
     public = Column(Boolean, default=True)
     author_id = Column(Integer, ForeignKey('author.id'))
+    code = Column(Integer)  # detail API code of the last refresh, e.g. -400/-404 once gone
+    refreshed = Column(Integer)
 
     author = relationship('Author', backref='videos')
 
@@ -133,15 +322,15 @@ class Video(Base):
     def full(self) -> te.Self:
         try:
             kwargs = self._others(self.id)
-        except Exception:  # code: -400
+        except Exception:
+            kwargs = {}
+        if kwargs.get('code') != 0:  # code: -400
             assert self.cover.exists()
-            return self
-        else:
-            return self.__class__(
-                id=self.id, title=self.title,
-                timestamp=self.timestamp, author_id=self.author_id,
-                **kwargs,
-            )
+        return self.__class__(
+            id=self.id, title=self.title,
+            timestamp=self.timestamp, author_id=self.author_id,
+            **kwargs,
+        )
 
     def to_remote(self) -> 'RemoteVideo':
         from .remote import Video
@@ -150,14 +339,38 @@ class Video(Base):
 
     @classmethod
     def _others(cls, id: int) -> t.Dict[str, t.Any]:
-        url = 'https://api.bilibili.com/x/web-interface/wbi/view/detail'
-        params = {'aid': id}
-        data = get(url, params=params).json()['data']
-        cls._cover(id).write_bytes(get(data['View']['pic']).content)
-        return {
-            'tags': '\t'.join(tag['tag_name'] for tag in data['Tags']),
-            'description': data['View']['desc'],
-        }
+        from .media import fetch
+        from .util import get
+
+        url, params = cls._request(id)
+        payload = get(url, params=params).json()
+        if payload['code'] == 0:
+            fetch(payload['data']['View']['pic'], cls._cover(id))
+        return cls._parse(payload)
+
+    @classmethod
+    async def _aothers(cls, id: int) -> t.Dict[str, t.Any]:
+        from .media import afetch
+        from .util import aget
+
+        url, params = cls._request(id)
+        payload = (await aget(url, params=params)).json()
+        if payload['code'] == 0:
+            await afetch(payload['data']['View']['pic'], cls._cover(id))
+        return cls._parse(payload)
+
+    @staticmethod
+    def _request(id: int) -> t.Tuple[str, t.Dict[str, t.Any]]:
+        return 'https://api.bilibili.com/x/web-interface/wbi/view/detail', {'aid': id}
+
+    @staticmethod
+    def _parse(payload: t.Dict) -> t.Dict[str, t.Any]:
+        ans = {'code': payload['code'], 'refreshed': int(time.time())}
+        if payload['code'] == 0:
+            data = payload['data']
+            ans['tags'] = '\t'.join(tag['tag_name'] for tag in data['Tags'])
+            ans['description'] = data['View']['desc']
+        return ans
 
     @staticmethod
     def _cover(id: int) -> p.Path:
@@ -168,4 +381,91 @@ class Video(Base):
         return DOWNLOAD_VIDEO / str(id)
 
 
-Base.metadata.create_all(engine, checkfirst=True)
+class Media(Base):
+    __tablename__ = 'media'
+
+    url = Column(String(256), primary_key=True)
+    digest = Column(String(32), nullable=False)
+    size = Column(Integer, nullable=False)
+    etag = Column(String(128))
+    modified = Column(String(64))
+
+
+class File(Base):
+    # what `lib verify` last saw; a file whose size and mtime still match is not read again
+    __tablename__ = 'file'
+
+    path = Column(String(256), primary_key=True)
+    size = Column(Integer, nullable=False)
+    mtime = Column(Integer, nullable=False)  # st_mtime_ns
+    digest = Column(String(48), nullable=False)  # <algorithm>:<hex>
+    checked = Column(Integer, nullable=False)
+    probe = Column(String(256))  # what ffprobe (or the image check) complained about, '' if nothing
+    probed = Column(Integer)  # the mtime the probe result belongs to
+
+
+class Favorite(Base):
+    __tablename__ = 'favorite'
+
+    id = Column(Integer, primary_key=True)
+    fingerprint = Column(String(32))  # media_count and first page, see remote.Favorite.fingerprint
+    interval = Column(Float, nullable=False)  # seconds between polls, adapted to how often it changes
+    checked = Column(Integer)
+    changed = Column(Integer)
+
+
+class FavoriteVideo(Base):
+    # membership history; no foreign keys, as members are recorded before (or without) being synced
+    __tablename__ = 'favorite_video'
+    __table_args__ = {'sqlite_with_rowid': False}
+
+    favorite_id = Column(Integer, primary_key=True)
+    video_id = Column(Integer, primary_key=True)
+    attr = Column(Integer, nullable=False)  # as listed: 0 ok, 1 or 9 gone from the site
+    added = Column(Integer, nullable=False)
+    removed = Column(Integer)  # NULL while listed
+
+
+class Danmaku(Base):
+    __tablename__ = 'danmaku'
+
+    video_id = Column(Integer, ForeignKey('video.id'), primary_key=True)
+    mtime = Column(Integer, nullable=False)  # newest *.xml st_mtime_ns when counted
+    tokens = Column(Integer, nullable=False)
+
+
+class Term(Base):
+    __tablename__ = 'term'
+
+    id = Column(Integer, primary_key=True)
+    text = Column(String(64), nullable=False, unique=True)
+
+
+class Tag(Base):
+    # normalized copy of Video.tags, kept current by triggers (see migrate.py)
+    __tablename__ = 'tag'
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String(64), nullable=False, unique=True)
+
+
+class VideoTag(Base):
+    __tablename__ = 'video_tag'
+    __table_args__ = {'sqlite_with_rowid': False}
+
+    tag_id = Column(Integer, ForeignKey('tag.id'), primary_key=True)
+    video_id = Column(Integer, ForeignKey('video.id'), primary_key=True)
+
+    @staticmethod
+    def videos(name: str) -> t.Any:
+        # ids of the videos tagged `name`, for Video.id.in_(...)
+        return select(VideoTag.video_id).join(Tag, Tag.id == VideoTag.tag_id).where(Tag.name == name)
+
+
+class VideoTerm(Base):
+    __tablename__ = 'video_term'
+    __table_args__ = {'sqlite_with_rowid': False}
+
+    video_id = Column(Integer, ForeignKey('video.id'), primary_key=True)
+    term_id = Column(Integer, ForeignKey('term.id'), primary_key=True)
+    count = Column(Integer, nullable=False)
@@ -0,0 +1,98 @@
+import asyncio
+import hashlib
+import os
+import pathlib as p
+import shutil
+import threading as th
+import typing as t
+
+import httpx
+
+from .config import DOWNLOAD_BLOB
+from .local import Media, Session
+from .metrics import observe
+from .util import aget, get
+
+
+def fetch(url: str, path: p.Path) -> bool:
+    record, headers = _conditional(url, path)
+    return _store(record, url, path, get(url, headers=headers))
+
+
+async def afetch(url: str, path: p.Path) -> bool:
+    # the lookup, the hashing and the writes are blocking, so they run off the event loop
+    record, headers = await asyncio.to_thread(_conditional, url, path)
+    response = await aget(url, headers=headers)
+    return await asyncio.to_thread(_store, record, url, path, response)
+
+
+def blob(digest: str) -> p.Path:
+    return DOWNLOAD_BLOB / digest[:2] / digest
+
+
+def _conditional(url: str, path: p.Path) -> t.Tuple[t.Optional[Media], t.Dict[str, str]]:
+    with Session() as session:
+        record = session.session.get(Media, url)
+    headers = {}
+    # a 304 is only useful while the blob the validators describe is still around
+    if record is not None and blob(record.digest).exists():
+        if record.etag:
+            headers['If-None-Match'] = record.etag
+        if record.modified:
+            headers['If-Modified-Since'] = record.modified
+    return record, headers
+
+
+def _store(record: t.Optional[Media], url: str, path: p.Path, response: httpx.Response) -> bool:
+    if response.status_code == 304 and record is not None:
+        observe('media', 'not modified')
+        return _place(blob(record.digest), path)
+    response.raise_for_status()
+    observe('media', 'fetched')
+    content = response.content
+    digest = hashlib.blake2b(content, digest_size=16).hexdigest()
+    target = blob(digest)
+    if not target.exists():
+        _replace(target, lambda temp: temp.write_bytes(content))
+    changed = _place(target, path)
+    media = Media(
+        url=url, digest=digest, size=len(content),
+        etag=response.headers.get('ETag'),
+        modified=response.headers.get('Last-Modified'),
+    )
+    if record is None or (record.digest, record.etag, record.modified) != (media.digest, media.etag, media.modified):
+        with Session() as session:
+            session.upsert(media)
+    return changed
+
+
+def _place(target: p.Path, path: p.Path) -> bool:
+    # identical bytes share one inode; nothing is written when the link (or a copy, see _link) is already there
+    if path.exists() and (os.path.samefile(path, target) or _copied(target, path)):
+        return False
+    _replace(path, lambda temp: _link(target, temp))
+    return True
+
+
+def _copied(target: p.Path, path: p.Path) -> bool:
+    # blobs are named after their digest, so a copy is recognized without a second hash of the blob
+    if path.stat().st_size != target.stat().st_size:
+        return False
+    return hashlib.blake2b(path.read_bytes(), digest_size=16).hexdigest() == target.name
+
+
+def _link(src: p.Path, dst: p.Path) -> None:
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+def _replace(path: p.Path, write: t.Callable[[p.Path], t.Any]) -> None:
+    temp = path.with_name(f'.{path.name}.{os.getpid()}-{th.get_ident()}.part')
+    path.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        write(temp)
+        temp.replace(path)
+    finally:
+        temp.unlink(missing_ok=True)
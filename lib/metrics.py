@@ -0,0 +1,84 @@
+import collections as c
+import contextlib
+import json
+import sys
+import threading as th
+import time
+import typing as t
+
+if t.TYPE_CHECKING:
+    from tenacity import RetryCallState
+
+
+# process-wide and thread-safe, so every stage of a run can report into one place
+_lock = th.Lock()
+_counters: t.Counter[str] = c.Counter()
+_histograms: t.DefaultDict[str, t.Counter[str]] = c.defaultdict(c.Counter)
+_timers: t.Dict[str, t.List[float]] = {}  # name -> [calls, total seconds, max seconds]
+_start = time.monotonic()
+
+
+def count(name: str, value: float = 1) -> None:
+    with _lock:
+        _counters[name] += value
+
+
+def observe(name: str, key: t.Any, value: float = 1) -> None:
+    with _lock:
+        _histograms[name][str(key)] += value
+
+
+def record(name: str, seconds: float) -> None:
+    with _lock:
+        timer = _timers.setdefault(name, [0, 0.0, 0.0])
+        timer[0] += 1
+        timer[1] += seconds
+        timer[2] = max(timer[2], seconds)
+
+
+@contextlib.contextmanager
+def timer(name: str) -> t.Iterator[None]:
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        record(name, time.monotonic()-start)
+
+
+def retried(retry_state: 'RetryCallState') -> None:
+    # tenacity before_sleep hook: one entry per retry, keyed by function and cause
+    exception = retry_state.outcome.exception() if retry_state.outcome else None
+    function = getattr(retry_state.fn, '__qualname__', '?')
+    count('retry')
+    observe('retry', f'{function}: {type(exception).__name__}')
+
+
+def report() -> t.Dict[str, t.Any]:
+    with _lock:
+        return {
+            'elapsed': time.monotonic() - _start,
+            'counters': dict(_counters),
+            'histograms': {name: dict(histogram.most_common()) for name, histogram in sorted(_histograms.items())},
+            'timers': {
+                name: {'calls': calls, 'total': total, 'mean': total/calls, 'max': max_}
+                for name, (calls, total, max_) in sorted(_timers.items())
+            },
+        }
+
+
+def dump(path: str) -> None:
+    text = json.dumps(report(), ensure_ascii=False, indent=2)
+    if path == '-':
+        print(text, file=sys.stderr)
+    else:
+        with open(path, 'w') as file:
+            file.write(text)
+
+
+def reset() -> None:
+    global _start
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+        _timers.clear()
+        _start = time.monotonic()
@@ -0,0 +1,168 @@
+import sqlite3
+import typing as t
+
+if t.TYPE_CHECKING:
+    from sqlalchemy.engine import Connection, Engine
+
+
+Step = t.Union[str, t.Callable[['Connection'], None]]
+BATCH = 20000  # video rows per INSERT ... SELECT of a backfill
+MAX = 1 << 62  # past any video id
+TRIGRAM = (3, 34, 0)  # the first SQLite with the trigram tokenizer
+
+
+class Migration(t.NamedTuple):
+    version: int
+    name: str
+    steps: t.List[Step]
+
+
+def migrate(engine: 'Engine') -> t.List[Migration]:
+    # in place and in order; each migration commits together with the PRAGMA user_version it reaches
+    ans = []
+    for migration in pending(engine):
+        with engine.begin() as connection:
+            for step in migration.steps:
+                if isinstance(step, str):
+                    connection.exec_driver_sql(step)
+                else:
+                    step(connection)
+            connection.exec_driver_sql(f'PRAGMA user_version = {migration.version}')
+        ans.append(migration)
+    with engine.begin() as connection:
+        if version(connection) >= 2 and not fts(connection):
+            _fts(connection)
+    return ans
+
+
+def pending(engine: 'Engine') -> t.List[Migration]:
+    with engine.connect() as connection:
+        current = version(connection)
+    return [migration for migration in MIGRATIONS if migration.version > current]
+
+
+def version(connection: 'Connection') -> int:
+    return connection.exec_driver_sql('PRAGMA user_version').scalar()
+
+
+def fts(connection: 'Connection') -> bool:
+    return connection.exec_driver_sql("SELECT 1 FROM sqlite_master WHERE name = 'video_fts'").first() is not None
+
+
+def _columns(table: str, columns: t.Dict[str, str]) -> Step:
+    # ALTER TABLE only appends: nothing is copied, and columns create_all already made are skipped
+    def step(connection: 'Connection') -> None:
+        existing = {row[1] for row in connection.exec_driver_sql(f'PRAGMA table_info({table})')}
+        for name, type in columns.items():
+            if name not in existing:
+                connection.exec_driver_sql(f'ALTER TABLE {table} ADD COLUMN {name} {type}')
+    return step
+
+
+def _batched(statement: str) -> Step:
+    # `statement` takes a half-open video id range as ? and ?; ranges hold BATCH existing rows each,
+    # since aids are sparse (post-2024 ones are around 1e14)
+    def step(connection: 'Connection') -> None:
+        start = connection.exec_driver_sql('SELECT min(id) FROM video').scalar()
+        while start is not None:
+            end = connection.exec_driver_sql(
+                'SELECT id FROM video WHERE id >= ? ORDER BY id LIMIT 1 OFFSET ?', (start, BATCH),
+            ).scalar()
+            connection.exec_driver_sql(statement, (start, MAX if end is None else end))
+            start = end
+    return step
+
+
+def _split(column: str) -> str:
+    # tab-joined tags as a JSON array for json_each, as triggers cannot use a recursive CTE
+    array = rf'''('["' || replace(replace(replace(coalesce({column}, ''), '\', '\\'), '"', '\"'), char(9), '","') || '"]')'''
+    return f"(CASE WHEN json_valid({array}) THEN {array} ELSE '[]' END)"
+
+
+def _tags(video: str, tags: str) -> str:
+    # no OR IGNORE: inside a trigger the conflict policy of the outer statement (an upsert) wins
+    return f'''
+        DELETE FROM video_tag WHERE video_id = {video};
+        INSERT INTO tag(name) SELECT DISTINCT item.value FROM json_each({_split(tags)}) AS item
+            WHERE item.value != '' AND NOT EXISTS (SELECT 1 FROM tag WHERE tag.name = item.value);
+        INSERT INTO video_tag(tag_id, video_id) SELECT DISTINCT tag.id, {video}
+            FROM json_each({_split(tags)}) AS item JOIN tag ON tag.name = item.value;
+    '''
+
+
+# full-text index over video text and author names, kept current by triggers; rowid = video.id
+# (trigram: CJK titles have no word boundaries for unicode61 to split on)
+FTS = [
+    '''CREATE VIRTUAL TABLE IF NOT EXISTS video_fts
+        USING fts5(title, tags, description, author, danmaku, tokenize='trigram')''',
+    '''CREATE TRIGGER IF NOT EXISTS video_fts_insert AFTER INSERT ON video BEGIN
+        INSERT INTO video_fts(rowid, title, tags, description, author)
+        VALUES (new.id, new.title, new.tags, new.description, (SELECT name FROM author WHERE id = new.author_id));
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS video_fts_update AFTER UPDATE OF title, tags, description, author_id ON video BEGIN
+        UPDATE video_fts SET
+            title = new.title, tags = new.tags, description = new.description,
+            author = (SELECT name FROM author WHERE id = new.author_id)
+        WHERE rowid = new.id;
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS video_fts_delete AFTER DELETE ON video BEGIN
+        DELETE FROM video_fts WHERE rowid = old.id;
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS author_fts_insert AFTER INSERT ON author BEGIN
+        UPDATE video_fts SET author = new.name WHERE rowid IN (SELECT id FROM video WHERE author_id = new.id);
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS author_fts_update AFTER UPDATE OF name ON author BEGIN
+        UPDATE video_fts SET author = new.name WHERE rowid IN (SELECT id FROM video WHERE author_id = new.id);
+    END''',
+    '''INSERT INTO video_fts(rowid, title, tags, description, author)
+        SELECT video.id, video.title, video.tags, video.description, author.name
+        FROM video LEFT JOIN author ON author.id = video.author_id
+        WHERE NOT EXISTS (SELECT 1 FROM video_fts LIMIT 1)''',
+]
+
+
+def _fts(connection: 'Connection') -> None:
+    # skipped below 3.34, where lib.search falls back to LIKE; migrate() builds it once SQLite is upgraded
+    if sqlite3.sqlite_version_info >= TRIGRAM:
+        for statement in FTS:
+            connection.exec_driver_sql(statement)
+
+
+MIGRATIONS = [
+    Migration(1, 'columns added since the first schema (was script/upgrade_1.py and upgrade_2.py)', [
+        _columns('author', {'refreshed': 'INTEGER'}),
+        _columns('video', {'public': 'BOOLEAN DEFAULT 1', 'code': 'INTEGER', 'refreshed': 'INTEGER'}),
+    ]),
+    Migration(2, 'full-text index', [_fts]),
+    # the app pages public videos by id; refresh, reconcile and filters go by author and time
+    Migration(3, 'secondary indexes', [
+        'CREATE INDEX IF NOT EXISTS ix_video_public_id ON video(public, id)',
+        'CREATE INDEX IF NOT EXISTS ix_video_author_id ON video(author_id)',
+        'CREATE INDEX IF NOT EXISTS ix_video_timestamp ON video(timestamp)',
+        'CREATE INDEX IF NOT EXISTS ix_favorite_video_video_id ON favorite_video(video_id)',
+    ]),
+    # Video.tags stays as the display copy; tag/video_tag answer "videos with tag X" by index
+    Migration(4, 'normalized tags', [
+        '''CREATE TABLE IF NOT EXISTS tag (
+            id INTEGER NOT NULL, name VARCHAR(64) NOT NULL,
+            PRIMARY KEY (id), UNIQUE (name)
+        )''',
+        '''CREATE TABLE IF NOT EXISTS video_tag (
+            tag_id INTEGER NOT NULL, video_id INTEGER NOT NULL,
+            PRIMARY KEY (tag_id, video_id),
+            FOREIGN KEY(tag_id) REFERENCES tag (id), FOREIGN KEY(video_id) REFERENCES video (id)
+        ) WITHOUT ROWID''',
+        'CREATE INDEX IF NOT EXISTS ix_video_tag_video_id ON video_tag(video_id)',
+        _batched(f'''INSERT OR IGNORE INTO tag(name) SELECT DISTINCT item.value
+            FROM video, json_each({_split('video.tags')}) AS item
+            WHERE video.id >= ? AND video.id < ? AND item.value != \'\''''),
+        _batched(f'''INSERT OR IGNORE INTO video_tag(tag_id, video_id) SELECT tag.id, video.id
+            FROM video, json_each({_split('video.tags')}) AS item JOIN tag ON tag.name = item.value
+            WHERE video.id >= ? AND video.id < ?'''),
+        f"CREATE TRIGGER IF NOT EXISTS video_tag_insert AFTER INSERT ON video BEGIN {_tags('new.id', 'new.tags')} END",
+        f"CREATE TRIGGER IF NOT EXISTS video_tag_update AFTER UPDATE OF tags ON video BEGIN {_tags('new.id', 'new.tags')} END",
+        '''CREATE TRIGGER IF NOT EXISTS video_tag_delete AFTER DELETE ON video BEGIN
+            DELETE FROM video_tag WHERE video_id = old.id;
+        END''',
+    ]),
+]
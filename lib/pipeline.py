@@ -0,0 +1,129 @@
+import queue
+import threading as th
+import typing as t
+
+from .local import Author, Session, Video
+from .metrics import count, timer
+
+
+Item = t.Tuple[Author, Video]
+
+_DONE = object()
+
+
+# favorite pages -> (1) producer -> (N) downloads -> (M) enrichers -> (1) writer
+class Pipeline:
+    def __init__(
+        self, session: Session, downloads: int = 4, enrichers: int = 4,
+        fast: bool = False, batch: int = 64, interval: float = 5.0,
+    ) -> None:
+        self._batch = session.batch(batch, interval)
+        self._authors = session.known(Author)
+        self._videos = session.known(Video)
+        self._fast = fast
+        self._stop = th.Event()   # no new downloads (--fast)
+        self._abort = th.Event()  # drop everything (error or interrupt)
+        self._errors: t.List[BaseException] = []
+        self._queues = [queue.Queue(maxsize=2*n) for n in (downloads, enrichers, enrichers)]
+        self._sizes = [1, downloads, enrichers, 1]
+        self.failed = self._batch.failed
+        self.written: t.List[int] = []
+
+    def run(self, items: t.Iterable[Item], callback: t.Callable[[], None] = lambda: None) -> int:
+        targets = [lambda: self._produce(items), self._download, self._enrich]
+        threads = []
+        for ith, target in enumerate(targets):
+            workers = [
+                th.Thread(target=self._guard, args=(target,), daemon=True)
+                for _ in range(self._sizes[ith])
+            ]
+            closer = th.Thread(target=self._close, args=(workers, ith), daemon=True)
+            threads.extend(workers + [closer])
+        for thread in threads:
+            thread.start()
+        try:
+            ans = self._write(callback)
+        except BaseException:
+            self._abort.set()
+            raise
+        for thread in threads:
+            thread.join()
+        if self._errors:
+            raise self._errors[0]
+        return ans
+
+    def _produce(self, items: t.Iterable[Item]) -> None:
+        queued = set()
+        for author, video in items:
+            if self._stop.is_set() or self._abort.is_set():
+                break
+            if video.id in self._videos:
+                if self._fast:
+                    break
+            elif video.id not in queued:
+                queued.add(video.id)
+                self._put(0, (author, video))
+
+    def _download(self) -> None:
+        for author, video in self._get(0):
+            if self._stop.is_set():
+                continue
+            with timer('sync download'):
+                ok = video.to_remote().download()
+            if ok:
+                self._put(1, (author, video))
+            else:
+                count('sync download failed')
+            if not ok and self._fast:
+                self._stop.set()
+
+    def _enrich(self) -> None:
+        for author, video in self._get(1):
+            if author.id not in self._authors:
+                with timer('sync author'):
+                    author = author.full()
+            with timer('sync video'):
+                video = video.full()
+            self._put(2, (author, video))
+
+    def _write(self, callback: t.Callable[[], None]) -> int:
+        ans = 0
+        with self._batch as batch:
+            for author, video in self._get(2, idle=batch.tick):
+                batch.put(author, video)
+                self.written.append(video.id)
+                ans += 1
+                callback()
+        return ans
+
+    def _guard(self, target: t.Callable[[], None]) -> None:
+        try:
+            target()
+        except BaseException as e:
+            self._errors.append(e)
+            self._abort.set()
+
+    def _close(self, workers: t.List[th.Thread], ith: int) -> None:
+        for worker in workers:
+            worker.join()
+        for _ in range(self._sizes[ith+1]):
+            self._put(ith, _DONE, force=True)
+
+    def _get(self, ith: int, idle: t.Optional[t.Callable[[], t.Any]] = None) -> t.Iterator[t.Any]:
+        while True:
+            try:
+                item = self._queues[ith].get(timeout=None if idle is None else 1.0)
+            except queue.Empty:
+                idle()
+                continue
+            if item is _DONE:
+                break
+            if not self._abort.is_set():
+                yield item
+
+    def _put(self, ith: int, item: t.Any, force: bool = False) -> None:
+        while force or not self._abort.is_set():
+            try:
+                return self._queues[ith].put(item, timeout=0.1)
+            except queue.Full:
+                pass
@@ -0,0 +1,80 @@
+import time
+import typing as t
+
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.sql.expression import select, update
+
+from .local import FavoriteVideo, Session, Video
+from .remote import Favorite
+
+
+class Diff(t.NamedTuple):
+    added: t.List[int]
+    removed: t.List[int]
+    unavailable: t.List[int]  # listed, but gone from the site
+
+
+class Rescued(t.NamedTuple):
+    video: Video
+    reason: str
+
+
+def unavailable(attr: int) -> bool:
+    return bool(attr & 1)  # 1: removed, 9: removed by the uploader
+
+
+def reconcile(id: int) -> Diff:
+    # one pass over the remote list, then set differences against the recorded membership
+    remote = dict(Favorite(id).members())
+    now = int(time.time())
+    with Session() as session:
+        query = select(FavoriteVideo.video_id, FavoriteVideo.removed, FavoriteVideo.attr) \
+            .where(FavoriteVideo.favorite_id == id)
+        history = {video: (removed, attr) for video, removed, attr in session.session.execute(query)}
+        listed = {video for video, (removed, _) in history.items() if removed is None}
+        added = sorted(remote.keys() - listed)
+        removed = sorted(listed - remote.keys())
+        changed = [video for video, attr in remote.items() if history.get(video) != (None, attr)]
+        if changed:
+            statement = insert(FavoriteVideo)
+            session.session.execute(
+                statement.on_conflict_do_update(
+                    index_elements=['favorite_id', 'video_id'],
+                    set_={'attr': statement.excluded.attr, 'removed': None},
+                ),
+                [{'favorite_id': id, 'video_id': video, 'attr': remote[video], 'added': now} for video in changed],
+            )
+        if removed:
+            session.session.execute(
+                update(FavoriteVideo),
+                [{'favorite_id': id, 'video_id': video, 'removed': now} for video in removed],
+            )
+        session.session.commit()
+    return Diff(added, removed, sorted(video for video, attr in remote.items() if unavailable(attr)))
+
+
+def rescued() -> t.Iterator[Rescued]:
+    # backed up videos that the site or every reconciled list no longer has, or that no such list ever had
+    with Session() as session:
+        tracked: t.Set[int] = set()
+        listed: t.Set[int] = set()
+        gone: t.Set[int] = set()
+        for video, attr, removed in session.session.execute(
+            select(FavoriteVideo.video_id, FavoriteVideo.attr, FavoriteVideo.removed)
+        ):
+            tracked.add(video)
+            if removed is None:
+                listed.add(video)
+                if unavailable(attr):
+                    gone.add(video)
+        for video in session.query(Video).order_by(Video.id):
+            if video.code not in (None, 0):
+                yield Rescued(video, f'code {video.code}')
+            elif video.id in gone:
+                yield Rescued(video, 'unavailable')
+            elif video.id in listed or not tracked:
+                continue  # with nothing reconciled yet, there is no list to be missing from
+            elif video.id in tracked:
+                yield Rescued(video, 'unlisted')
+            else:
+                yield Rescued(video, 'local only')
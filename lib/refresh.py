@@ -0,0 +1,51 @@
+import asyncio
+import collections as c
+import concurrent.futures as cf
+import time
+import typing as t
+
+from sqlalchemy.sql.expression import or_, select
+from tqdm import tqdm
+
+from .local import Author, Batch, Session, Video
+from .util import aclose
+
+
+Row = t.Union[Author, Video]
+
+
+async def run(age: float, concurrency: int, batch: int) -> t.Counter[str]:
+    ans: t.Counter[str] = c.Counter()
+    cutoff = int(time.time() - age)
+    queue: asyncio.Queue = asyncio.Queue()
+    with Session() as session:
+        for Type in (Author, Video):
+            stale = or_(Type.refreshed.is_(None), Type.refreshed < cutoff)
+            for id in session.session.execute(select(Type.id).where(stale)).scalars():
+                queue.put_nowait((Type, id))
+        # one writer thread: a flush commits without stalling the event loop, and Batch stays single-threaded
+        with session.batch(batch, interval=30.0) as writer, tqdm(total=queue.qsize()) as bar, \
+                cf.ThreadPoolExecutor(1) as executor:
+            try:
+                await asyncio.gather(*(_worker(queue, writer, executor, bar, ans) for _ in range(concurrency)))
+            finally:
+                await aclose()
+        if writer.failed:
+            ans['unwritten'] = len(writer.failed)
+    return ans
+
+
+async def _worker(
+    queue: asyncio.Queue, writer: Batch, executor: cf.Executor, bar: tqdm, ans: t.Counter[str],
+) -> None:
+    while not queue.empty():
+        Type, id = queue.get_nowait()
+        try:
+            row = Type(id=id, **await Type._aothers(id))
+        except Exception:
+            ans['failed'] += 1
+        else:
+            code = getattr(row, 'code', 0)
+            ans[Type.__tablename__ if code == 0 else f'code {code}'] += 1
+            await asyncio.get_running_loop().run_in_executor(executor, writer.put, row)
+        bar.update()
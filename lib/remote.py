@@ -1,43 +1,93 @@
-import functools as f
+import collections as c
+import concurrent.futures as cf
+import hashlib
+import json
+import math
 import pathlib as p
-import shutil
+import struct
 import subprocess as sp
 import typing as t
 
-import httpx
+from .bvid import bv, url
+from .local import Author, Video as LocalVideo
+from .metrics import timer
+from .util import get, retrying
 
-from tenacity import retry, stop, wait
 
-from .local import Author, Video as LocalVideo
-from .util import get
+PAGE_SIZE = 20  # the largest ps x/v3/fav/resource/list accepts
+WINDOW = 4
+
+T = t.TypeVar('T')
+
+
+def paginate(fetch: t.Callable[[int], t.List[T]], pages: int, window: int = WINDOW) -> t.Iterator[T]:
+    # pages are yielded in order; look-ahead starts once the consumer takes a page's first item
+    executor = cf.ThreadPoolExecutor(window)
+    futures: t.Deque[cf.Future] = c.deque()
+    submitted = 0
+
+    def top(size: int) -> None:
+        nonlocal submitted
+        while submitted < pages and len(futures) < size:
+            submitted += 1
+            futures.append(executor.submit(fetch, submitted))
+
+    try:
+        for _ in range(pages):
+            top(1)
+            for ith, item in enumerate(futures.popleft().result()):
+                yield item
+                if ith == 0:
+                    top(window)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
 
 
 class Favorite:
     def __init__(self, id: int) -> None:
         self._id = id
+        self._first: t.Optional[t.Dict] = None
 
     def number(self) -> int:
-        return self._page(1).json()['data']['info']['media_count']
+        return self._data(1)['info']['media_count']
 
-    def videos(self) -> t.Iterator[t.Tuple[Author, LocalVideo]]:
-        ith = 0
-        while True:
-            ith += 1
-            data = self._page(ith).json()['data']
-            for item in self._page_medias(ith):
-                yield (Author.fromDict(item), LocalVideo.fromDict(item))
-            if not data['has_more']:
-                break
+    def pages(self) -> int:
+        return max(1, math.ceil(self.number()/PAGE_SIZE))
 
-    @f.lru_cache(maxsize=5)
-    def _page(self, ith: int) -> httpx.Response:
+    def fingerprint(self) -> str:
+        # one request: additions, removals and re-orders (order=mtime) all show up in the first page or the count
+        data = self._data(1)
+        items = [(item['id'], item.get('fav_time')) for item in data['medias'] or []]
+        value = json.dumps([data['info']['media_count'], items])
+        return hashlib.blake2b(value.encode(), digest_size=16).hexdigest()
+
+    def videos(self) -> t.Iterator[t.Tuple[Author, LocalVideo]]:
+        for item in paginate(self._page_medias, self.pages()):
+            yield (Author.fromDict(item), LocalVideo.fromDict(item))
+
+    def members(self) -> t.Iterator[t.Tuple[int, int]]:
+        for item in paginate(self._page_medias, self.pages()):
+            yield item['id'], item.get('attr', 0)
+
+    def _data(self, ith: int) -> t.Dict:
+        if ith != 1:
+            return self._page(ith)
+        if self._first is None:
+            self._first = self._page(1)
+        return self._first
+
+    @retrying
+    def _page(self, ith: int) -> t.Dict:
         url = 'https://api.bilibili.com/x/v3/fav/resource/list'
-        params = {'media_id': self._id, 'pn': ith, 'ps': 20, 'order': 'mtime'}
-        return get(url, params=params)
+        params = {'media_id': self._id, 'pn': ith, 'ps': PAGE_SIZE, 'order': 'mtime'}
+        with timer('sync page'):
+            data = get(url, params=params).json()
+        if data['code'] != 0:
+            raise ValueError(f'favorite {self._id} page {ith}: {data["code"]} {data["message"]}')
+        return data['data']
 
-    @retry(stop=stop.stop_after_attempt(5), wait=wait.wait_fixed(1))
     def _page_medias(self, ith: int) -> t.List:
-        return self._page(ith).json()['data']['medias']
+        return self._data(ith)['medias'] or []
 
 
 class Favorites:
@@ -48,8 +98,13 @@ class Favorites:
         return sum(favorite.number() for favorite in self._favorites)
 
     def videos(self) -> t.Iterator[t.Tuple[Author, LocalVideo]]:
-        for favorite in self._favorites:
-            yield from favorite.videos()
+        iterators = c.deque(favorite.videos() for favorite in self._favorites)
+        while iterators:
+            iterator = iterators.popleft()
+            for item in iterator:
+                iterators.append(iterator)
+                yield item
+                break
 
 
 class Video:
@@ -58,54 +113,115 @@ class Video:
 
     @property
     def bv(self) -> str:
-        table = 'fZodR9XQDSUm21yCkr6zBqiveYah8bt4xsWpHnJE7jL5VG3guMTKNPAwcF'
-        r = list('BV1  4 1 7  ')
-        s = [11, 10, 3, 8, 4, 6]
-        x = (self._id^177451812) + 8728348608
-        for i in range(6):
-            r[s[i]] = table[x//58**i%58]
-        return ''.join(r)
+        return bv(self._id)
 
     @property
     def url(self) -> str:
-        return f'https://www.bilibili.com/video/{self.bv}/'
+        return url(self._id)
 
-    def download(self) -> bool:
-        directory = LocalVideo._directory(self._id)
-        if directory.exists():
-            return True
-        args = [
-            'you-get',
-            '--playlist',
-            '--output-dir', directory,
-            f'https://www.bilibili.com/video/{self.bv}',
-        ]
-        try:
-            return 0 == sp.run(args, capture_output=True).returncode
-        except KeyboardInterrupt:
-            shutil.rmtree(directory, ignore_errors=True)
-            return False
+    def download(self, connections: int = 4) -> bool:
+        from .download import Downloader
+
+        return Downloader(self._id, LocalVideo._directory(self._id), connections).run()
 
-    def ffmpeg(self) -> bool:
+    def ffmpeg(self, threads: int = 0, force: bool = False) -> bool:
         ans = True
-        directory = LocalVideo._directory(self._id)
-        temp = directory / '_.mp4'
-        for path in directory.glob('*.mp4'):
-            shutil.copy(path, temp)
-            try:
-                ans &= 0 == self._ffmpeg(temp, path).returncode
-            except KeyboardInterrupt:
-                shutil.copy(temp, path)
-                return False
-        temp.unlink(missing_ok=True)
+        for path in LocalVideo._directory(self._id).glob('*.mp4'):
+            ans &= self.transcode(path, threads, force=force).ok
         return ans
 
-    def _ffmpeg(self, src: p.Path, dst: p.Path) -> sp.CompletedProcess:
+    def transcode(
+        self, path: p.Path, threads: int = 0,
+        progress: t.Optional[t.Callable[[int], None]] = None, force: bool = False,
+    ) -> 'Transcode':
+        action = 'encode' if force else self._action(path)
+        if action == 'skip':
+            return Transcode(True, action, 0, 0)
+        # the original stays in place until the result is complete, then is swapped atomically
+        temp = path.with_name(f'.{path.name}.part')
+        try:
+            code = self._ffmpeg(path, temp, threads, progress, remux=action=='remux')
+        except KeyboardInterrupt:
+            code = -1
+        if code != 0:
+            temp.unlink(missing_ok=True)
+            return Transcode(False, action, path.stat().st_size, 0)
+        read, written = path.stat().st_size, temp.stat().st_size
+        temp.replace(path)
+        return Transcode(True, action, read, written)
+
+    def _action(self, path: p.Path) -> str:
+        args = ['ffprobe', '-v', 'error', '-print_format', 'json', '-show_streams', path]
+        try:
+            cp = sp.run(args, capture_output=True)
+        except FileNotFoundError:
+            return 'encode'
+        if cp.returncode != 0:
+            return 'encode'
+        streams = json.loads(cp.stdout).get('streams', [])
+        if not all(map(self._compliant, streams)):
+            return 'encode'
+        return 'skip' if self._faststart(path) else 'remux'
+
+    @staticmethod
+    def _compliant(stream: t.Dict[str, t.Any]) -> bool:
+        if stream.get('codec_type') == 'video':
+            return stream.get('codec_name') == 'h264' \
+                and stream.get('profile') in {'Baseline', 'Constrained Baseline'} \
+                and 0 < stream.get('level', 0) <= 30 \
+                and stream.get('pix_fmt') == 'yuv420p'
+        if stream.get('codec_type') == 'audio':
+            return stream.get('codec_name') == 'aac' and stream.get('channels', 0) <= 2
+        return True
+
+    @staticmethod
+    def _faststart(path: p.Path) -> bool:
+        # top-level boxes: faststart means moov comes before mdat
+        with path.open('rb') as file:
+            while True:
+                header = file.read(8)
+                if len(header) < 8:
+                    return False
+                size, kind = struct.unpack('>I4s', header)
+                if kind == b'moov':
+                    return True
+                if kind == b'mdat' or size == 0:
+                    return False
+                if size == 1:
+                    large = file.read(8)
+                    if len(large) < 8:
+                        return False
+                    size = struct.unpack('>Q', large)[0] - 8
+                if size < 8:  # corrupt: seeking back would loop forever
+                    return False
+                file.seek(size-8, 1)
+
+    def _ffmpeg(
+        self, src: p.Path, dst: p.Path, threads: int = 0,
+        progress: t.Optional[t.Callable[[int], None]] = None, remux: bool = False,
+    ) -> int:
         # https://superuser.com/questions/859010/what-ffmpeg-command-line-produces-video-more-compatible-across-all-devices
-        args = [
-            'ffmpeg', '-y', '-i', src,
+        codecs = ['-c', 'copy'] if remux else [
             '-c:v', 'libx264', '-crf', '23', '-profile:v', 'baseline',
             '-level', '3.0', '-pix_fmt', 'yuv420p', '-c:a', 'aac', '-ac', '2',
-            '-b:a', '128k', '-movflags', 'faststart', dst,
+            '-b:a', '128k', '-threads', str(threads),
+        ]
+        args = [
+            'ffmpeg', '-y', '-nostdin', '-nostats', '-progress', 'pipe:1', '-i', src,
+            *codecs, '-movflags', 'faststart', '-f', 'mp4', dst,
         ]
-        return sp.run(args, capture_output=True)
+        with sp.Popen(args, stdout=sp.PIPE, stderr=sp.DEVNULL, text=True) as process:
+            frame = 0
+            for line in process.stdout:
+                key, _, value = line.strip().partition('=')
+                if key == 'frame' and value.isdigit() and progress is not None:
+                    progress(int(value)-frame)
+                    frame = int(value)
+            return process.wait()
+
+
+class Transcode(t.NamedTuple):
+    ok: bool
+    action: str  # skip | remux | encode
+    read: int
+    written: int
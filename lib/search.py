@@ -0,0 +1,86 @@
+import re
+import typing as t
+
+from sqlalchemy.sql.expression import text
+
+from .danmaku import XML
+from .local import Session, Video
+from .migrate import fts
+
+
+COLUMNS = ['title', 'tags', 'description', 'author', 'danmaku']
+WEIGHTS = [10.0, 5.0, 2.0, 4.0, 1.0]  # bm25 weight per column, in COLUMNS order
+# terms the index cannot take are LIKE scans: 1-2 characters only look at the short columns,
+# longer ones (SQLite older than 3.34 has no trigram tokenizer) at everything but danmaku
+SHORT = ['video.title', 'video.tags']
+LIKE = ['video.title', 'video.tags', 'video.description', 'author.name']
+
+
+class Hit(t.NamedTuple):
+    id: int
+    title: str
+    author: str
+    rank: float
+
+
+def search(query: str, public: t.Optional[bool] = None, limit: int = 20, offset: int = 0) -> t.Tuple[int, t.List[Hit]]:
+    with Session() as session:
+        indexed = fts(session.session.connection())
+        where, params = _where(query, indexed)
+        if public is not None:
+            where.append('video.public = :public')
+            params['public'] = public
+        match = any(term.startswith('video_fts MATCH') for term in where)
+        rank = f'bm25(video_fts, {", ".join(map(str, WEIGHTS))})' if match else '-video.id'
+        # without a MATCH the index has nothing to offer, and its rows are much wider than video's;
+        # CROSS JOIN keeps video_fts outermost, else ix_video_public_id leads and each row runs the MATCH
+        source = 'video_fts CROSS JOIN video ON video.id = video_fts.rowid' if match \
+            else 'video LEFT JOIN author ON author.id = video.author_id'
+        body = f'''
+            FROM {source}
+            WHERE {' AND '.join(where) or '1'}
+        '''
+        author = 'video_fts.author' if match else 'author.name'
+        total = session.session.execute(text(f'SELECT count(*) {body}'), params).scalar()
+        rows = session.session.execute(
+            text(f'SELECT video.id, video.title, {author}, {rank} AS rank {body} ORDER BY rank LIMIT :limit OFFSET :offset'),
+            {**params, 'limit': limit, 'offset': offset},
+        )
+        return total, [Hit(*row) for row in rows]
+
+
+def index_danmaku(ids: t.Optional[t.Iterable[int]] = None) -> int:
+    ans = 0
+    with Session() as session:
+        if not fts(session.session.connection()):
+            return 0
+        if ids is None:
+            ids = list(session.session.execute(text('SELECT rowid FROM video_fts WHERE danmaku IS NULL')).scalars())
+        for id in ids:
+            lines = [line for path in sorted(Video._directory(id).glob('*.xml')) for line in XML(path).texts()]
+            session.session.execute(
+                text('UPDATE video_fts SET danmaku = :danmaku WHERE rowid = :id'),
+                {'danmaku': '\n'.join(lines), 'id': id},
+            )
+            ans += 1
+            if ans % 256 == 0:
+                session.session.commit()
+        session.session.commit()
+    return ans
+
+
+def _where(query: str, indexed: bool = True) -> t.Tuple[t.List[str], t.Dict[str, t.Any]]:
+    # trigram only indexes terms of 3+ characters; shorter ones (and all without the index) fall back to LIKE
+    where, params, phrases = [], {}, []
+    for ith, term in enumerate(re.split(r'\s+', query.strip())):
+        if len(term) >= 3 and indexed:
+            phrases.append('"{}"'.format(term.replace('"', '""')))
+        elif term:
+            params[f'like{ith}'] = '%{}%'.format(re.sub(r'([%_\\])', r'\\\1', term))
+            where.append('({})'.format(' OR '.join(
+                f"{column} LIKE :like{ith} ESCAPE '\\'" for column in (SHORT if len(term) < 3 else LIKE)
+            )))
+    if phrases:
+        where.insert(0, 'video_fts MATCH :match')
+        params['match'] = ' AND '.join(phrases)
+    return where, params
@@ -0,0 +1,161 @@
+import email.utils
+import hmac
+import http.server as hs
+import mimetypes
+import os
+import pathlib as p
+import re
+import threading as th
+import time
+import typing as t
+import urllib.parse
+
+from sqlalchemy.sql.expression import select
+
+from .config import DOWNLOAD_COVER, DOWNLOAD_THUMBNAIL, DOWNLOAD_VIDEO
+from .local import Session, Video
+
+
+ROOTS = {'video': DOWNLOAD_VIDEO, 'cover': DOWNLOAD_COVER, 'thumbnail': DOWNLOAD_THUMBNAIL}
+TTL = 60.0  # seconds before the set of non-public videos is read again
+LIFETIME = 86400  # seconds a signed url stays valid, give or take the hour it is rounded to
+
+
+class Handler(hs.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_HEAD(self) -> None:
+        self._serve(body=False)
+
+    def do_GET(self) -> None:
+        self._serve(body=True)
+
+    def log_message(self, *args: t.Any) -> None:
+        pass
+
+    def _serve(self, body: bool) -> None:
+        path = self._resolve()
+        if path is None:
+            return self._status(404)
+        stat = path.stat()
+        etag = f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+        if etag in self.headers.get('If-None-Match', ''):
+            return self._status(304, {'ETag': etag})
+        start, end, status = 0, stat.st_size - 1, 200
+        range = self._range(stat.st_size)
+        if range is False:
+            return self._status(416, {'Content-Range': f'bytes */{stat.st_size}'})
+        if range is not None and self.headers.get('If-Range', etag) == etag:
+            (start, end), status = range, 206
+        length = max(0, end - start + 1)
+        headers = {
+            'Accept-Ranges': 'bytes',
+            'Cache-Control': 'public, max-age=3600',
+            'Content-Length': str(length),
+            'Content-Type': mimetypes.guess_type(path.name)[0] or 'application/octet-stream',
+            'ETag': etag,
+            'Last-Modified': email.utils.formatdate(stat.st_mtime, usegmt=True),
+        }
+        if status == 206:
+            headers['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+        self._status(status, headers)
+        if body and length:
+            with path.open('rb') as file:
+                try:
+                    self.wfile.flush()
+                    self.connection.sendfile(file, start, length)  # os.sendfile where available
+                except (BrokenPipeError, ConnectionResetError):
+                    self.close_connection = True  # players drop range requests all the time
+
+    def _resolve(self) -> t.Optional[p.Path]:
+        split = urllib.parse.urlsplit(self.path)
+        parts = urllib.parse.unquote(split.path).strip('/').split('/', 1)
+        if len(parts) != 2 or parts[0] not in ROOTS:
+            return None
+        root = ROOTS[parts[0]].resolve()
+        path = (root / parts[1]).resolve()
+        if root not in path.parents or not path.is_file():
+            return None
+        query = dict(urllib.parse.parse_qsl(split.query))
+        if not self.server.allowed(parts[0], path.relative_to(root), query.get('expires', ''), query.get('signature', '')):
+            return None  # not found rather than forbidden: which ids are hidden is not told either
+        return path
+
+    def _range(self, size: int) -> t.Union[None, bool, t.Tuple[int, int]]:
+        match = re.fullmatch(r'\s*bytes=(\d*)-(\d*)\s*', self.headers.get('Range', ''))
+        if match is None or not any(match.groups()):
+            return None  # absent, multi-range or malformed: send everything
+        if not match[1]:
+            start, end = max(0, size - int(match[2])), size - 1
+        else:
+            start, end = int(match[1]), min(size - 1, int(match[2] or size - 1))
+        return (start, end) if start <= end else False
+
+    def _status(self, status: int, headers: t.Dict[str, str] = {}) -> None:
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        if 'Content-Length' not in headers:
+            self.send_header('Content-Length', '0')
+        self.end_headers()
+
+
+class Server(hs.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host: str, port: int, secret: t.Optional[bytes] = None) -> None:
+        super().__init__((host, port), Handler)
+        self._secret = secret  # files of videos that are not public need a url signed with it
+        self._hidden: t.FrozenSet[int] = frozenset()
+        self._loaded = -float('inf')
+        self._lock = th.Lock()
+
+    def allowed(self, kind: str, path: p.Path, expires: str = '', signature: str = '') -> bool:
+        id = _video(kind, path)
+        if id is None or id not in self.hidden():
+            return True
+        if self._secret is None or not expires.isdigit() or int(expires) < time.time():
+            return False
+        return hmac.compare_digest(signature, _sign(self._secret, kind, path.as_posix(), expires))
+
+    def hidden(self) -> t.FrozenSet[int]:
+        with self._lock:
+            if time.monotonic() - self._loaded > TTL:
+                with Session() as session:
+                    ids = session.session.execute(select(Video.id).where(Video.public == False)).scalars()
+                    self._hidden = frozenset(ids)
+                self._loaded = time.monotonic()
+            return self._hidden
+
+    def start(self) -> th.Thread:
+        thread = th.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+
+def _video(kind: str, path: p.Path) -> t.Optional[int]:
+    # video/<id>/…, cover/<id>.jpg and thumbnail/cover/<id>.…; avatars belong to no video
+    if kind == 'video':
+        name = path.parts[0]
+    elif kind == 'cover':
+        name = path.stem
+    elif kind == 'thumbnail' and path.parts[0] == 'cover':
+        name = path.parts[-1].split('.', 1)[0]
+    else:
+        return None
+    return int(name) if name.isdigit() else None
+
+
+def _sign(secret: bytes, kind: str, relative: str, expires: str) -> str:
+    return hmac.new(secret, f'{kind}/{relative}:{expires}'.encode(), 'sha256').hexdigest()
+
+
+def url(base: str, kind: str, path: p.Path, secret: t.Optional[bytes] = None) -> str:
+    # with `secret`, signed: the server then also hands out files of videos that are not public
+    relative = path.relative_to(ROOTS[kind]).as_posix()
+    ans = f'{base.rstrip("/")}/{kind}/{urllib.parse.quote(relative)}'
+    if secret is None:
+        return ans
+    # rounded to the hour, so the url (and the browser's cache of it) stays the same over reruns
+    expires = str((int(time.time()) + LIFETIME) // 3600 * 3600 + 3600)
+    return f'{ans}?' + urllib.parse.urlencode({'expires': expires, 'signature': _sign(secret, kind, relative, expires)})
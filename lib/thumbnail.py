@@ -0,0 +1,97 @@
+import concurrent.futures as cf
+import functools as f
+import hashlib
+import importlib.util
+import os
+import pathlib as p
+import threading as th
+import typing as t
+
+import typing_extensions as te
+
+from .config import DOWNLOAD_THUMBNAIL
+
+
+SIZES = (160, 320, 640)  # longest side, in pixels
+AVAILABLE = importlib.util.find_spec('PIL') is not None
+
+
+def thumbnail(path: p.Path, size: int) -> t.Optional[p.Path]:
+    # the derivative of `path` fitting in size x size, made on first use; None without Pillow or source
+    if not AVAILABLE or not path.exists():
+        return None
+    stat = path.stat()
+    target = _target(path, _digest(path.as_posix(), stat.st_size, stat.st_mtime_ns), size)
+    if not target.exists():
+        _make(path, target, size)
+    return target
+
+
+def make(path: p.Path) -> int:
+    # every size of one source; for the process pool
+    return sum(thumbnail(path, size) is not None for size in SIZES)
+
+
+class Thumbnailer:
+    # background process pool that sync feeds with the covers and avatars it wrote
+    def __init__(self, workers: t.Optional[int] = None) -> None:
+        self._executor = cf.ProcessPoolExecutor(workers) if AVAILABLE else None
+        self._futures: t.List[cf.Future] = []
+
+    def __enter__(self) -> te.Self:
+        return self
+
+    def __exit__(self, *args, **kwargs) -> None:
+        self.close()
+
+    def submit(self, paths: t.Iterable[p.Path]) -> None:
+        if self._executor is not None:
+            self._futures.extend(self._executor.submit(make, path) for path in set(paths))
+
+    def close(self) -> int:
+        # waits for what was submitted; sources that are missing or not images are skipped
+        if self._executor is None:
+            return 0
+        ans = sum(future.result() for future in self._futures if future.exception() is None)
+        self._futures = []
+        self._executor.shutdown()
+        return ans
+
+
+@f.lru_cache(maxsize=65536)
+def _digest(path: str, size: int, mtime: int) -> str:
+    # keyed by stat, so an app rerun does not read hundreds of covers again
+    with open(path, 'rb') as file:
+        return hashlib.blake2b(file.read(), digest_size=16).hexdigest()
+
+
+@f.lru_cache(maxsize=None)
+def _format() -> t.Tuple[str, str]:
+    from PIL import features
+
+    return ('WEBP', 'webp') if features.check('webp') else ('JPEG', 'jpg')
+
+
+def _target(path: p.Path, digest: str, size: int) -> p.Path:
+    # named after the source (cover/<video id>.…), so lib.serve can tell which video a thumbnail shows
+    return DOWNLOAD_THUMBNAIL / path.parent.name / f'{path.stem}.{digest}-{size}.{_format()[1]}'
+
+
+def _make(path: p.Path, target: p.Path, size: int) -> None:
+    from PIL import Image
+
+    format, _ = _format()
+    target.parent.mkdir(parents=True, exist_ok=True)
+    temp = target.with_name(f'.{target.name}.{os.getpid()}-{th.get_ident()}.part')
+    try:
+        with Image.open(path) as image:
+            image.draft('RGB', (size, size))  # JPEG: let the decoder downscale first
+            image = image.convert('RGB')
+            image.thumbnail((size, size), Image.LANCZOS)
+            if format == 'WEBP':
+                image.save(temp, format, quality=80, method=4)
+            else:
+                image.save(temp, format, quality=80, optimize=True, progressive=True)
+        temp.replace(target)
+    finally:
+        temp.unlink(missing_ok=True)
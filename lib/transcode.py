@@ -0,0 +1,92 @@
+import collections as c
+import concurrent.futures as cf
+import os
+import pathlib as p
+import threading as th
+import time
+import typing as t
+
+from tqdm import tqdm
+
+from .local import Video
+from .metrics import count, record
+
+if t.TYPE_CHECKING:
+    from .remote import Transcode
+
+
+Job = t.Tuple[Video, p.Path, int]
+
+
+def cpus() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+class Scheduler:
+    # K concurrent ffmpeg processes, each with a -threads share of the CPU budget
+    def __init__(self, jobs: int, budget: t.Optional[int] = None, force: bool = False) -> None:
+        self._jobs = max(1, jobs)
+        self._threads = max(1, (budget or cpus()) // self._jobs)
+        self._force = force
+        self._frames = 0
+        self._lock = th.Lock()
+        self.stats: t.Counter[str] = c.Counter()
+
+    def run(self, videos: t.Iterable[Video]) -> t.List[Video]:
+        jobs = self._plan(videos)
+        remaining: t.Dict[int, int] = {}
+        failed: t.Dict[int, Video] = {}
+        for video, _, _ in jobs:
+            remaining[video.id] = remaining.get(video.id, 0) + 1
+        start = time.monotonic()
+        executor = cf.ThreadPoolExecutor(self._jobs)
+        with tqdm(total=sum(size for _, _, size in jobs), unit='B', unit_scale=True, unit_divisor=1024) as bar:
+            futures = {executor.submit(self._one, *job): job for job in jobs}
+            try:
+                for future in cf.as_completed(futures):
+                    video, _, size = futures[future]
+                    result = future.result()
+                    self.stats.update({result.action: 1, 'read': result.read, 'written': result.written})
+                    if not result.ok:
+                        failed[video.id] = video
+                    remaining[video.id] -= 1
+                    # the marker is only written once every part of a video went through
+                    if remaining[video.id] == 0 and video.id not in failed:
+                        self._marker(video).touch(exist_ok=True)
+                    bar.set_postfix(fps=f'{self._frames/(time.monotonic()-start):.1f}', refresh=False)
+                    bar.update(size)
+            except BaseException:
+                executor.shutdown(wait=True, cancel_futures=True)
+                raise
+        executor.shutdown()
+        return list(failed.values())
+
+    def _plan(self, videos: t.Iterable[Video]) -> t.List[Job]:
+        jobs = []
+        for video in videos:
+            if not self._marker(video).exists():
+                paths = list(video.directory.glob('*.mp4'))
+                jobs.extend((video, path, path.stat().st_size) for path in paths)
+                if not paths and video.directory.exists():
+                    self._marker(video).touch(exist_ok=True)
+        # largest first, so the longest encodes do not start last and dominate the tail
+        return sorted(jobs, key=lambda job: job[2], reverse=True)
+
+    def _one(self, video: Video, path: p.Path, size: int) -> 'Transcode':
+        start = time.monotonic()
+        ans = video.to_remote().transcode(path, self._threads, self._progress, self._force)
+        record(f'ffmpeg {ans.action}', time.monotonic()-start)
+        count('ffmpeg read', ans.read)
+        count('ffmpeg written', ans.written)
+        return ans
+
+    def _progress(self, frames: int) -> None:
+        with self._lock:
+            self._frames += frames
+
+    @staticmethod
+    def _marker(video: Video) -> p.Path:
+        return video.directory / 'ffmpeg.done'
@@ -1,17 +1,168 @@
+import asyncio
+import functools as f
+import importlib.util
 import json
+import random
+import threading as th
+import time
+import typing as t
+import weakref
 
 import httpx
 
-from tenacity import retry, stop, wait
+from tenacity import RetryCallState, retry, stop, wait
 
-from .config import COOKIES as PATH, HEADERS
+from .config import COOKIES, HEADERS, RATES
+from .metrics import count, observe, record, retried, timer
 
 
-COOKIES = json.loads(PATH.read_text()) if PATH.exists() else {}
+HTTP2 = importlib.util.find_spec('h2') is not None
+THROTTLE = {412, 429}
+RETRY = THROTTLE | {500, 502, 503, 504}
 
+_BUCKETS: 't.Dict[str, t.Optional[Bucket]]' = {}
+_ACLIENTS: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]' = weakref.WeakKeyDictionary()
+_TRANSPORTS: t.Dict[str, t.Any] = {}
 
-@retry(stop=stop.stop_after_attempt(5), wait=wait.wait_fixed(1))
-def get(*args, **kwargs) -> httpx.Response:
-    kwargs['cookies'] = COOKIES | kwargs.pop('cookies', {})
-    kwargs['headers'] = HEADERS | kwargs.pop('headers', {})
-    return httpx.get(*args, **kwargs)
+
+class Throttled(Exception):
+    def __init__(self, response: httpx.Response) -> None:
+        super().__init__(f'{response.status_code} {response.url}')
+        self.response = response
+
+    @property
+    def after(self) -> float:
+        try:
+            return float(self.response.headers.get('Retry-After', 0))
+        except ValueError:
+            return 0.0
+
+
+class Bucket:
+    def __init__(self, rate: float, burst: int) -> None:
+        self._rate = rate
+        self._burst = burst
+        self._tokens = float(burst)
+        self._time = time.monotonic()
+        self._lock = th.Lock()
+
+    def reserve(self) -> float:
+        # take one token, return how long to sleep before it may be used
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._burst, self._tokens + (now-self._time)*self._rate)
+            self._time = now
+            self._tokens -= 1
+            return max(0.0, -self._tokens/self._rate)
+
+    def penalize(self, seconds: float) -> None:
+        with self._lock:
+            self._tokens = min(self._tokens, -seconds*self._rate)
+
+
+class backoff(wait.wait_base):
+    def __init__(self, base: float = 0.5, cap: float = 30.0) -> None:
+        self._base = base
+        self._cap = cap
+
+    def __call__(self, retry_state: RetryCallState) -> float:
+        ans = min(self._cap, self._base * 2**(retry_state.attempt_number-1))
+        exception = retry_state.outcome.exception() if retry_state.outcome else None
+        if isinstance(exception, Throttled):
+            ans = max(ans, exception.after)
+        return ans + random.uniform(0, self._base)
+
+
+retrying = retry(stop=stop.stop_after_attempt(5), wait=backoff(), before_sleep=retried)
+
+
+def bucket(host: str) -> t.Optional[Bucket]:
+    if host not in _BUCKETS:
+        _BUCKETS[host] = next((
+            Bucket(rate, burst) for suffix, (rate, burst) in RATES.items()
+            if host == suffix or host.endswith(f'.{suffix}')
+        ), None)
+    return _BUCKETS[host]
+
+
+def limit(host: str, rate: float, burst: t.Optional[int] = None) -> None:
+    _BUCKETS[host] = Bucket(rate, burst or max(1, int(rate)))
+
+
+def route(
+    transport: t.Optional[httpx.BaseTransport] = None,
+    atransport: t.Optional[httpx.AsyncBaseTransport] = None,
+) -> None:
+    # send all traffic through other transports, e.g. to the local stand-in of bench
+    _TRANSPORTS.update(transport=transport, atransport=atransport)
+    client.cache_clear()
+    _ACLIENTS.clear()
+
+
+@f.lru_cache(maxsize=None)
+def client() -> httpx.Client:
+    return httpx.Client(**_options(), transport=_TRANSPORTS.get('transport'))
+
+
+def aclient() -> httpx.AsyncClient:
+    loop = asyncio.get_running_loop()
+    if loop not in _ACLIENTS:
+        _ACLIENTS[loop] = httpx.AsyncClient(**_options(), transport=_TRANSPORTS.get('atransport'))
+    return _ACLIENTS[loop]
+
+
+async def aclose() -> None:
+    client = _ACLIENTS.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+@retrying
+def get(url: t.Union[str, httpx.URL], **kwargs) -> httpx.Response:
+    url = httpx.URL(url)
+    time.sleep(_reserve(url))
+    with timer(f'http {url.host}'):
+        response = client().get(url, **kwargs)
+    return _check(url, response)
+
+
+@retrying
+async def aget(url: t.Union[str, httpx.URL], **kwargs) -> httpx.Response:
+    url = httpx.URL(url)
+    await asyncio.sleep(_reserve(url))
+    with timer(f'http {url.host}'):
+        response = await aclient().get(url, **kwargs)
+    return _check(url, response)
+
+
+@f.lru_cache(maxsize=None)
+def cookies() -> t.Dict[str, str]:
+    return json.loads(COOKIES.read_text()) if COOKIES.exists() else {}
+
+
+def _options() -> t.Dict[str, t.Any]:
+    return {
+        'cookies': cookies(),
+        'headers': HEADERS,
+        'http2': HTTP2,
+        'limits': httpx.Limits(max_connections=32, max_keepalive_connections=16, keepalive_expiry=30.0),
+    }
+
+
+def _reserve(url: httpx.URL) -> float:
+    limiter = bucket(url.host)
+    ans = 0.0 if limiter is None else limiter.reserve()
+    if ans:
+        record(f'throttle {url.host}', ans)
+    return ans
+
+
+def _check(url: httpx.URL, response: httpx.Response) -> httpx.Response:
+    observe('http status', response.status_code)
+    count('http bytes', response.num_bytes_downloaded)
+    if response.status_code in RETRY:
+        limiter = bucket(url.host)
+        if limiter is not None and response.status_code in THROTTLE:
+            limiter.penalize(Throttled(response).after or 1.0)
+        raise Throttled(response)
+    return response
@@ -0,0 +1,175 @@
+import concurrent.futures as cf
+import hashlib
+import importlib.util
+import json
+import os
+import pathlib as p
+import subprocess as sp
+import time
+import typing as t
+
+from sqlalchemy.sql.expression import delete, select
+from tqdm import tqdm
+
+from .config import DOWNLOAD_AVATAR, DOWNLOAD_COVER, DOWNLOAD_VIDEO
+from .download import MANIFEST
+from .local import Author, File, Session, Video
+
+
+ALGORITHM = 'xxh3' if importlib.util.find_spec('xxhash') is not None else 'blake2b'
+BUFFER = 1 << 20
+MEDIA = {'.mp4', '.m4s', '.flv'}
+IMAGES = (b'\xff\xd8\xff', b'\x89PNG', b'GIF8', b'RIFF')
+
+
+class Problem(t.NamedTuple):
+    kind: str  # changed | corrupt | broken | missing | incomplete | orphan | absent
+    path: str
+    detail: str = ''
+
+
+class Verifier:
+    # stat first: only new or modified files are hashed, unless `full` re-reads everything
+    def __init__(self, workers: t.Optional[int] = None, full: bool = False, probe: bool = False) -> None:
+        self._workers = workers
+        self._full = full
+        self._probe = probe
+        self.problems: t.List[Problem] = []
+
+    def run(self) -> t.List[Problem]:
+        with Session() as session:
+            known = {file.path: file for file in session.query(File)}
+            found = dict(_walk([DOWNLOAD_VIDEO, DOWNLOAD_COVER, DOWNLOAD_AVATAR]))
+            jobs = [
+                (path, stat) for path, stat in found.items()
+                if self._full or _changed(known.get(path), stat) or self._unprobed(known.get(path), path, stat)
+            ]
+            skipped = found.keys() - {path for path, _ in jobs}
+            self.problems.extend(
+                Problem('broken', path, known[path].probe) for path in sorted(skipped)
+                if known[path].probe and known[path].probed == found[path].st_mtime_ns
+            )
+            now = int(time.time())
+            with session.batch(256, float('inf')) as batch, \
+                    cf.ThreadPoolExecutor(self._workers) as executor, \
+                    tqdm(total=sum(stat.st_size for _, stat in jobs), unit='B', unit_scale=True, unit_divisor=1024) as bar:
+                futures = {executor.submit(self._check, path, stat, known.get(path)): (path, stat) for path, stat in jobs}
+                for future in cf.as_completed(futures):
+                    path, stat = futures[future]
+                    file, problems = future.result()
+                    file.checked = now
+                    batch.put(file)
+                    self.problems.extend(problems)
+                    bar.update(stat.st_size)
+            missing = sorted(known.keys() - found.keys())
+            for ith in range(0, len(missing), 512):
+                session.session.execute(delete(File).where(File.path.in_(missing[ith:ith+512])))
+            session.session.commit()
+            self.problems.extend(Problem('missing', path) for path in missing)
+            self.problems.extend(_orphans(session, found))
+        return self.problems
+
+    def _check(self, path: str, stat: os.stat_result, old: t.Optional[File]) -> t.Tuple[File, t.List[Problem]]:
+        problems = []
+        unchanged = not _changed(old, stat)
+        algorithm = old.digest.partition(':')[0] if old is not None and unchanged else ALGORITHM
+        digest = f'{algorithm}:{_hash(path, algorithm)}' if self._full or not unchanged else old.digest
+        if old is not None:
+            if unchanged and digest != old.digest:
+                problems.append(Problem('corrupt', path, 'same size and mtime, different content'))
+            elif not unchanged:
+                problems.append(Problem('changed', path))
+        file = File(path=path, size=stat.st_size, mtime=stat.st_mtime_ns, digest=digest)
+        if self._unprobed(old, path, stat):
+            file.probe = _inspect(path)
+            file.probed = None if file.probe is None else stat.st_mtime_ns
+        elif old is not None and old.probed == stat.st_mtime_ns:
+            file.probe = old.probe
+        if file.probe:
+            problems.append(Problem('broken', path, file.probe))
+        return file, problems
+
+    def _unprobed(self, old: t.Optional[File], path: str, stat: os.stat_result) -> bool:
+        # images are always looked at (a few bytes), media only with --probe
+        suffix = p.PurePath(path).suffix
+        return (suffix == '.jpg' or self._probe and suffix in MEDIA) \
+            and (old is None or old.probed != stat.st_mtime_ns)
+
+
+def _walk(roots: t.Iterable[p.Path]) -> t.Iterator[t.Tuple[str, os.stat_result]]:
+    stack = [root.as_posix() for root in roots if root.exists()]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.name.startswith('.'):  # temporary files of downloads, transcodes and the media store
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    yield entry.path, entry.stat()
+
+
+def _changed(old: t.Optional[File], stat: os.stat_result) -> bool:
+    return old is None or (old.size, old.mtime) != (stat.st_size, stat.st_mtime_ns)
+
+
+def _hash(path: str, algorithm: str) -> str:
+    if algorithm == 'xxh3':
+        import xxhash
+
+        hasher = xxhash.xxh3_128()
+    else:
+        hasher = hashlib.blake2b(digest_size=16)
+    buffer = bytearray(BUFFER)
+    view = memoryview(buffer)
+    with open(path, 'rb', buffering=0) as file:
+        while True:
+            size = file.readinto(buffer)
+            if not size:
+                break
+            hasher.update(view[:size])
+    return hasher.hexdigest()
+
+
+def _inspect(path: str) -> t.Optional[str]:
+    if p.PurePath(path).suffix != '.jpg':
+        return _ffprobe(path)
+    with open(path, 'rb') as file:
+        return '' if file.read(4).startswith(IMAGES) else 'not an image'
+
+
+def _ffprobe(path: str) -> t.Optional[str]:
+    args = ['ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'json', path]
+    try:
+        cp = sp.run(args, capture_output=True, text=True)
+    except FileNotFoundError:
+        return None  # nothing to probe with: left unprobed for a later run
+    if cp.returncode != 0 or cp.stderr.strip():
+        return (cp.stderr.strip() or f'ffprobe exited with {cp.returncode}').splitlines()[0][:256]
+    return ''
+
+
+def _orphans(session: Session, found: t.Dict[str, os.stat_result]) -> t.Iterator[Problem]:
+    videos = set(session.session.execute(select(Video.id)).scalars())
+    authors = set(session.session.execute(select(Author.id)).scalars())
+    directories = {}
+    if DOWNLOAD_VIDEO.exists():
+        directories = {int(path.name): path for path in DOWNLOAD_VIDEO.iterdir() if path.name.isdigit()}
+    for id, directory in sorted(directories.items()):
+        manifest = directory / MANIFEST
+        if id not in videos:
+            yield Problem('orphan', directory.as_posix(), 'no video row')
+        elif manifest.exists() and not json.loads(manifest.read_text()).get('complete', False):
+            yield Problem('incomplete', directory.as_posix(), 'download not finished')
+    for Type, ids, root in [(Video, videos, DOWNLOAD_COVER), (Author, authors, DOWNLOAD_AVATAR)]:
+        for path in sorted(root.glob('*.jpg')) if root.exists() else []:
+            if path.stem.isdigit() and int(path.stem) not in ids:
+                yield Problem('orphan', path.as_posix(), f'no {Type.__tablename__} row')
+    for id in sorted(videos - directories.keys()):
+        yield Problem('absent', Video._directory(id).as_posix(), 'video row without media')
+    for id in sorted(videos):
+        if Video._cover(id).as_posix() not in found:
+            yield Problem('absent', Video._cover(id).as_posix(), 'video row without cover')
+    for id in sorted(authors):
+        if Author._avatar(id).as_posix() not in found:
+            yield Problem('absent', Author._avatar(id).as_posix(), 'author row without avatar')
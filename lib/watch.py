@@ -0,0 +1,79 @@
+import heapq
+import importlib.util
+import time
+import typing as t
+
+from .local import Favorite, Session
+from .pipeline import Pipeline
+from .remote import Favorite as RemoteFavorite
+
+
+MINIMUM = 300.0
+MAXIMUM = 86400.0
+
+
+class Watcher:
+    # polls the fingerprint of each list on its own schedule, paginating deeply only on change;
+    # a list that changed is polled twice as often, one that did not 1.5x less often
+    def __init__(
+        self, ids: t.Iterable[int], minimum: float = MINIMUM, maximum: float = MAXIMUM,
+        downloads: int = 4, enrichers: int = 4, batch: int = 64,
+        echo: t.Callable[[str], t.Any] = print,
+    ) -> None:
+        self._minimum = minimum
+        self._maximum = maximum
+        self._options = {'downloads': downloads, 'enrichers': enrichers, 'batch': batch}
+        self._echo = echo
+        self._session = Session()
+        known = {favorite.id: favorite for favorite in self._session.query(Favorite)}
+        for id in set(ids) - known.keys():
+            known[id] = Favorite(id=id, interval=minimum)
+        self._favorites = known
+
+    def run(self, once: bool = False) -> None:
+        heap = [(favorite.checked or 0) + favorite.interval for favorite in self._favorites.values()]
+        heap = [(0.0 if once else due, id) for due, id in zip(heap, self._favorites)]
+        heapq.heapify(heap)
+        while heap:
+            due, id = heapq.heappop(heap)
+            time.sleep(max(0.0, due-time.time()))
+            favorite = self.poll(id)
+            if not once:
+                heapq.heappush(heap, (favorite.checked + favorite.interval, id))
+
+    def poll(self, id: int) -> Favorite:
+        favorite = self._favorites[id]
+        remote = RemoteFavorite(id)
+        now = int(time.time())
+        try:
+            fingerprint = remote.fingerprint()
+            changed = fingerprint != favorite.fingerprint
+            if changed:
+                self._sync(id, remote)
+        except Exception as e:  # the old fingerprint is kept, so the next poll tries again
+            self._echo(f'favorite {id}: {type(e).__name__} {e}')
+            fingerprint, changed, interval = favorite.fingerprint, False, favorite.interval
+        else:
+            interval = self._interval(favorite.interval, changed)
+        favorite = Favorite(
+            id=id, fingerprint=fingerprint, interval=interval, checked=now,
+            changed=now if changed else favorite.changed,
+        )
+        self._session.upsert(favorite)
+        self._favorites[id] = favorite
+        return favorite
+
+    def _sync(self, id: int, remote: RemoteFavorite) -> None:
+        # not --fast: re-ordered items may sit behind a known one, so every page is read
+        pipeline = Pipeline(self._session, **self._options)
+        number = pipeline.run(remote.videos())
+        for instance in pipeline.failed:
+            self._echo(f'failed: {type(instance).__name__} {instance.id}')
+        self._echo(f'favorite {id}: {number} new video(s)')
+        if pipeline.written and importlib.util.find_spec('jieba') is not None:
+            from .danmaku import index
+
+            index(pipeline.written)
+
+    def _interval(self, interval: float, changed: bool) -> float:
+        return min(self._maximum, max(self._minimum, interval/2 if changed else interval*1.5))
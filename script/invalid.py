@@ -2,25 +2,16 @@ __root__ = __import__('pathlib').Path(__file__).parents[1]
 __import__('sys').path.append(__root__.as_posix())
 
 
-import time
-
-import httpx
-import tqdm
-
-from lib.config import HEADERS
+from lib.bvid import urls
 from lib.local import Session, Video
 
 
-url = 'https://api.bilibili.com/x/web-interface/wbi/view/detail'
+# codes are recorded by `python -m lib refresh`
 with Session() as session:
-    total = session.query(Video).count()
-    for video in tqdm.tqdm(session.query(Video), total=total):
-        time.sleep(1.0)
-        params = {'aid': video.id}
-        data = httpx.get(url, params=params, headers=HEADERS).json()
-        if data['code'] != 0:
-            print(
-                data['code'], video.author.name,
-                video.title, video.to_remote().url,
-                sep='\t',
-            )
+    videos = session.query(Video).filter(Video.code != 0).order_by(Video.code, Video.id).all()
+    for video, url in zip(videos, urls([video.id for video in videos])):
+        print(
+            video.code, video.author.name,
+            video.title, url,
+            sep='\t',
+        )
@@ -19,7 +19,8 @@ with Session() as session:
         title = input('Video title part: ')
         if not title:
             break
-        videos = session.query(Video).filter(Video.title.like(f'%{title}%')).all()
+        # the title only, and every match: the full-text index also matches tags, authors and danmaku
+        videos = session.query(Video).filter(Video.title.contains(title, autoescape=True)).order_by(Video.id).all()
         if not videos:
             break
         for ith, video in enumerate(videos):
@@ -0,0 +1,82 @@
+import random
+
+import pytest
+
+from lib import bvid
+
+
+SEED = 0
+EDGES = [1, 2, 2**29-1, 2**29, 2**32, bvid.MAX_AID-1]
+
+
+def legacy(aid: int) -> str:
+    # the formula lib.remote.Video.bv used before lib.bvid, valid for aids below 2**29
+    table = 'fZodR9XQDSUm21yCkr6zBqiveYah8bt4xsWpHnJE7jL5VG3guMTKNPAwcF'
+    r = list('BV1  4 1 7  ')
+    s = [11, 10, 3, 8, 4, 6]
+    x = (aid^177451812) + 8728348608
+    for i in range(6):
+        r[s[i]] = table[x//58**i%58]
+    return ''.join(r)
+
+
+@pytest.fixture
+def aids() -> list:
+    generator = random.Random(SEED)
+    return EDGES + [generator.randrange(1, bvid.MAX_AID) for _ in range(20000)]
+
+
+@pytest.mark.parametrize('aid, value', [(2, 'BV1xx411c7mD'), (170001, 'BV17x411w7KC')])
+def test_known(aid: int, value: str) -> None:
+    assert bvid.bv(aid) == value
+    assert bvid.av(value) == aid
+
+
+def test_round_trip(aids: list) -> None:
+    values = [bvid.bv(aid) for aid in aids]
+    assert all(len(value) == bvid.LENGTH and value.startswith(bvid.PREFIX) for value in values)
+    assert len(set(values)) == len(set(aids))
+    assert [bvid.av(value) for value in values] == aids
+
+
+def test_batch(aids: list, monkeypatch: pytest.MonkeyPatch) -> None:
+    values = [bvid.bv(aid) for aid in aids]
+    assert bvid.bvs(aids) == values
+    assert bvid.avs(values) == aids
+    assert bvid.urls(aids[:3]) == [bvid.url(aid) for aid in aids[:3]]
+    monkeypatch.setattr(bvid, 'AVAILABLE', False)
+    assert bvid.bvs(aids) == values
+    assert bvid.avs(values) == aids
+
+
+def test_legacy() -> None:
+    generator = random.Random(SEED)
+    aids = [1, 2**29-1] + [generator.randrange(1, 2**29) for _ in range(20000)]
+    assert [bvid.bv(aid) for aid in aids] == list(map(legacy, aids))
+
+
+@pytest.mark.parametrize('text', ['170001', ' av170001 ', 'AV170001', 'BV17x411w7KC', 'bv17x411w7KC',
+    'https://www.bilibili.com/video/BV17x411w7KC/?p=2', 'https://www.bilibili.com/video/av170001'])
+def test_parse(text: str) -> None:
+    assert bvid.parse(text) == 170001
+
+
+@pytest.mark.parametrize('aid', [0, -1, bvid.MAX_AID])
+def test_aid_out_of_range(aid: int) -> None:
+    with pytest.raises(ValueError):
+        bvid.bv(aid)
+    with pytest.raises(ValueError):
+        bvid.bvs([aid]*bvid.VECTOR)
+
+
+@pytest.mark.parametrize('value', ['', 'BV17x411w7K', 'BV17x411w7KCC', 'AV17x411w7KC', 'BV17x411w7K0', 'BV17x411w7K中'])
+def test_not_a_bv(value: str) -> None:
+    with pytest.raises(ValueError):
+        bvid.av(value)
+    with pytest.raises(ValueError):
+        bvid.avs([value]*bvid.VECTOR)
+
+
+def test_parse_nothing() -> None:
+    with pytest.raises(ValueError):
+        bvid.parse('hello')
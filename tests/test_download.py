@@ -0,0 +1,88 @@
+import json
+import pathlib as p
+import subprocess as sp
+import typing as t
+
+import httpx
+import pytest
+
+from bench.server import ARedirect, Bilibili, Redirect, Server, media
+from lib import download, util
+
+
+ID = 170001
+SIZE = 100_000
+CHUNK = 16_384
+
+
+class Interrupted(Exception):
+    pass
+
+
+@pytest.fixture
+def muxed(monkeypatch: pytest.MonkeyPatch) -> t.List[t.List[bytes]]:
+    # ffmpeg stand-in: records the bytes of its inputs, in order, as the output
+    ans: t.List[t.List[bytes]] = []
+
+    def run(args: t.List[t.Any], **kwargs: t.Any) -> sp.CompletedProcess:
+        inputs = [p.Path(args[ith+1]) for ith, arg in enumerate(args) if arg == '-i']
+        if 'concat' in args:
+            inputs = [inputs[0].with_name(line[6:-1]) for line in inputs[0].read_text().splitlines()]
+        ans.append([path.read_bytes() for path in inputs])
+        p.Path(args[-1]).write_bytes(b''.join(ans[-1]))
+        return sp.CompletedProcess(args, 0)
+
+    monkeypatch.setattr(download.sp, 'run', run)
+    return ans
+
+
+@pytest.fixture(params=[0, 1, 3], ids=['dash', 'durl', 'segments'])
+def server(request: pytest.FixtureRequest, monkeypatch: pytest.MonkeyPatch) -> t.Iterator[Server]:
+    monkeypatch.setattr(download, 'CHUNK', CHUNK)
+    with Server(handler=Bilibili, media=SIZE, segments=request.param) as ans:
+        util.route(Redirect(ans.url), ARedirect(ans.url))
+        util.limit('api.bilibili.com', 1e9, 1 << 30)
+        try:
+            yield ans
+        finally:
+            util.route()
+
+
+def test_resume(server: Server, muxed: t.List[t.List[bytes]], tmp_path: p.Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    chunk = download.Downloader._chunk
+    calls: t.List[t.Tuple[str, int]] = []
+    budget = [5]  # chunks the first run gets before it is cut off
+
+    def counted(self: download.Downloader, stream: download.Stream, ith: int) -> None:
+        if not budget[0]:
+            raise Interrupted
+        budget[0] -= 1
+        chunk(self, stream, ith)
+        calls.append((stream['file'], ith))
+
+    directory = tmp_path / str(ID)
+    monkeypatch.setattr(download.Downloader, '_chunk', counted)
+    assert not download.Downloader(ID, directory, 1).run()
+    manifest = json.loads((directory/download.MANIFEST).read_text())
+    [part] = manifest['parts']
+    assert not manifest['complete'] and not part['done'] and not part['muxed']
+    done = {(stream['file'], ith) for stream in part['streams'] for ith in stream['done']}
+    assert done == set(calls) and len(done) == 5
+
+    calls.clear()
+    budget[0] = -1  # no cut-off
+    assert download.Downloader(ID, directory, 4).run()
+    assert not done & set(calls)  # nothing fetched twice
+    manifest = json.loads((directory/download.MANIFEST).read_text())
+    [part] = manifest['parts']
+    assert manifest['complete'] and part['done'] and part['muxed']
+    assert sum(-(-stream['size']//CHUNK) for stream in part['streams']) == len(done) + len(calls)
+    [inputs] = muxed
+    assert inputs == [media(httpx.URL(stream['url']).path, SIZE) for stream in part['streams']]
+    if server.segments:
+        assert [stream['kind'] for stream in part['streams']] == ['segment'] * server.segments
+    else:
+        assert [stream['kind'] for stream in part['streams']] == ['video', 'audio']
+        assert '.7.video' in part['streams'][0]['url']  # AVC over HEVC
+    assert sorted(path.name for path in directory.iterdir()) == sorted([f'video {ID}.cmt.xml', f'video {ID}.mp4', download.MANIFEST])
+    assert download.Downloader(ID, directory).complete()
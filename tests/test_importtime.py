@@ -0,0 +1,12 @@
+import pathlib as p
+import typing as t
+
+import pytest
+
+from bench.imports import BUDGET, COMMANDS, milliseconds
+
+
+@pytest.mark.parametrize('args', COMMANDS, ids=lambda args: ' '.join(['lib', *args]))
+def test_budget(args: t.List[str], tmp_path: p.Path) -> None:
+    # a fresh working directory, as lib keeps everything under a relative data/
+    assert milliseconds(args, tmp_path, 3) <= BUDGET
@@ -0,0 +1,59 @@
+import sqlite3
+import time
+
+import pytest
+from sqlalchemy.engine import create_engine
+
+from lib import migrate
+from lib.local import Base
+
+
+# the schema before migrations existed: no public/code/refreshed, no tag tables, no FTS
+OLD = '''
+CREATE TABLE author (id INTEGER PRIMARY KEY, name VARCHAR(32) NOT NULL, sex VARCHAR(4), sign VARCHAR(128));
+CREATE TABLE video (
+    id INTEGER PRIMARY KEY, title VARCHAR(128) NOT NULL, timestamp INTEGER NOT NULL,
+    tags VARCHAR(256), description VARCHAR(512), author_id INTEGER REFERENCES author(id)
+);
+'''
+
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    monkeypatch.setattr(migrate, 'BATCH', 3)
+    path = tmp_path / 'db.sqlite'
+    with sqlite3.connect(path) as connection:
+        connection.executescript(OLD)
+        connection.execute("INSERT INTO author VALUES (1, 'alice', '', '')")
+        rows = [(id, f'video {id}', id, f'tag {id%3}\tshared', '', 1) for id in range(1, 11)]
+        rows += [(999_000_000, 'old aid', 1, 'big', '', 1), (113_000_000_000_001, 'new aid', 1, 'big\tshared', '', 1)]
+        connection.executemany('INSERT INTO video VALUES (?, ?, ?, ?, ?, ?)', rows)
+    ans = create_engine(f'sqlite:///{path}')
+    Base.metadata.create_all(ans, checkfirst=True)  # as local.engine() does before migrating
+    return ans
+
+
+def test_large_aids(engine):
+    start = time.monotonic()
+    applied = migrate.migrate(engine)
+    assert time.monotonic() - start < 5
+    assert [migration.version for migration in applied] == [migration.version for migration in migrate.MIGRATIONS]
+    assert migrate.pending(engine) == []
+    with engine.connect() as connection:
+        rows = connection.exec_driver_sql('''
+            SELECT video_tag.video_id, tag.name FROM video_tag JOIN tag ON tag.id = video_tag.tag_id
+        ''').all()
+    assert len(rows) == 10*2 + 1 + 2
+    assert {name for id, name in rows if id == 113_000_000_000_001} == {'big', 'shared'}
+
+
+def test_triggers(engine):
+    migrate.migrate(engine)
+    with engine.begin() as connection:
+        connection.exec_driver_sql("UPDATE video SET tags = 'x\tx\ty' WHERE id = 113000000000001")
+        connection.exec_driver_sql("INSERT INTO video(id, title, timestamp, tags) VALUES (2000000000000000, 'n', 1, 'y')")
+        rows = connection.exec_driver_sql('''
+            SELECT video_tag.video_id, tag.name FROM video_tag JOIN tag ON tag.id = video_tag.tag_id
+            WHERE video_tag.video_id > 1000000000 ORDER BY 1, 2
+        ''').all()
+    assert rows == [(113_000_000_000_001, 'x'), (113_000_000_000_001, 'y'), (2_000_000_000_000_000, 'y')]
@@ -0,0 +1,35 @@
+import pathlib as p
+import typing as t
+
+import pytest
+
+from lib import local, reconcile
+
+
+@pytest.fixture
+def session(tmp_path: p.Path, monkeypatch: pytest.MonkeyPatch) -> t.Iterator[local.Session]:
+    monkeypatch.setattr(local, 'DATABASE', tmp_path/'db.sqlite')
+    local.engine.cache_clear()
+    with local.Session() as ans:
+        yield ans
+    local.engine.cache_clear()
+
+
+def members(*videos: t.Tuple[int, int]) -> t.Callable[[reconcile.Favorite], t.Iterator[t.Tuple[int, int]]]:
+    return lambda self: iter(videos)
+
+
+def test_rescued(session: local.Session, monkeypatch: pytest.MonkeyPatch) -> None:
+    session.session.add_all(
+        local.Video(id=id, title=str(id), timestamp=0, code=code)
+        for id, code in [(1, None), (2, None), (3, None), (4, -404), (999, None)]
+    )
+    session.session.commit()
+    assert [video.id for video, _ in reconcile.rescued()] == [4]  # nothing reconciled yet: no list to miss from
+    monkeypatch.setattr(reconcile.Favorite, 'members', members((1, 0), (2, 0), (3, 0)))
+    assert reconcile.reconcile(7) == reconcile.Diff([1, 2, 3], [], [])
+    monkeypatch.setattr(reconcile.Favorite, 'members', members((1, 0), (3, 9), (5, 0)))
+    assert reconcile.reconcile(7) == reconcile.Diff([5], [2], [3])
+    assert [(video.id, reason) for video, reason in reconcile.rescued()] == [
+        (2, 'unlisted'), (3, 'unavailable'), (4, 'code -404'), (999, 'local only'),
+    ]
@@ -0,0 +1,63 @@
+import http.client
+import pathlib as p
+import typing as t
+
+import pytest
+
+from lib import serve
+
+
+SECRET = b'secret'
+HIDDEN = frozenset({2})
+
+
+@pytest.fixture
+def server(tmp_path: p.Path, monkeypatch: pytest.MonkeyPatch) -> t.Iterator[serve.Server]:
+    monkeypatch.setattr(serve, 'ROOTS', {'video': tmp_path/'video'})
+    for id in (1, 2):
+        (tmp_path/'video'/str(id)).mkdir(parents=True)
+        for name in ('p1.mp4', 'p2.mp4'):
+            (tmp_path/'video'/str(id)/name).write_bytes(b'part')
+    ans = serve.Server('127.0.0.1', 0, SECRET)
+    monkeypatch.setattr(ans, 'hidden', lambda: HIDDEN)
+    ans.start()
+    yield ans
+    ans.shutdown()
+    ans.server_close()
+
+
+def status(server: serve.Server, id: int, name: str = 'p1.mp4', secret: t.Optional[bytes] = None) -> int:
+    url = serve.url('', 'video', serve.ROOTS['video']/str(id)/name, secret)
+    connection = http.client.HTTPConnection(*server.server_address[:2])
+    connection.request('GET', url)
+    response = connection.getresponse()
+    response.read()
+    connection.close()
+    return response.status
+
+
+def test_public(server: serve.Server) -> None:
+    assert status(server, 1) == 200
+
+
+def test_signed(server: serve.Server) -> None:
+    assert status(server, 2) == 404
+    assert status(server, 2, secret=b'other') == 404
+    assert status(server, 2, secret=SECRET) == 200
+
+
+def test_signature_covers_one_file(server: serve.Server) -> None:
+    url = serve.url('', 'video', serve.ROOTS['video']/'2'/'p1.mp4', SECRET).replace('p1.mp4', 'p2.mp4')
+    connection = http.client.HTTPConnection(*server.server_address[:2])
+    connection.request('GET', url)
+    assert connection.getresponse().status == 404
+
+
+def test_expired(server: serve.Server, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(serve, 'LIFETIME', -2*3600)
+    assert status(server, 2, secret=SECRET) == 404
+
+
+def test_without_secret(server: serve.Server) -> None:
+    server._secret = None
+    assert status(server, 2, secret=SECRET) == 404